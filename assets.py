@@ -0,0 +1,120 @@
+"""
+Arquivos estáticos com URL versionada pelo conteúdo
+O index.html é servido com cada /static/... reescrito para /static/...?v=<hash>
+e um import map para os módulos JS. URLs com o hash atual são imutáveis
+(cache de 1 ano); qualquer outra URL é revalidada por ETag/Last-Modified.
+"""
+
+import hashlib
+import json
+import re
+import threading
+import time
+from pathlib import Path
+
+from fastapi import Request
+from fastapi.responses import HTMLResponse, Response
+from fastapi.staticfiles import StaticFiles
+
+STATIC_DIR = Path(__file__).parent / "static"
+
+CACHE_IMUTAVEL = "public, max-age=31536000, immutable"
+CACHE_REVALIDAR = "no-cache"
+
+_REF_ESTATICA = re.compile(r'(src|href)="/static/([^"?#]+)(?:\?[^"]*)?"')
+
+
+class AssetManifest:
+    """
+    Hash do conteúdo de cada arquivo em static/. Recalculado quando algum
+    mtime muda, então editar um JS em produção já gera URL nova. A pasta é
+    conferida no máximo a cada `checagem` segundos: a conferência roda no event
+    loop a cada arquivo estático servido.
+    """
+
+    def __init__(self, static_dir: Path, checagem: float = 5.0):
+        self.static_dir = static_dir
+        self.checagem = checagem
+        self._lock = threading.Lock()
+        self._ultima_checagem = 0.0
+        self._assinatura = None
+        self._hashes: dict[str, str] = {}
+        self._index: tuple[str, str] | None = None
+
+    def _atualizar(self):
+        agora = time.monotonic()
+        if self._assinatura is not None and agora - self._ultima_checagem < self.checagem:
+            return
+        self._ultima_checagem = agora
+        arquivos = sorted(p for p in self.static_dir.rglob("*") if p.is_file())
+        assinatura = tuple((str(p), p.stat().st_mtime_ns, p.stat().st_size) for p in arquivos)
+        if assinatura == self._assinatura:
+            return
+        with self._lock:
+            if assinatura == self._assinatura:
+                return
+            self._hashes = {
+                p.relative_to(self.static_dir).as_posix(): hashlib.sha256(p.read_bytes()).hexdigest()[:12]
+                for p in arquivos
+            }
+            self._index = None
+            self._assinatura = assinatura
+
+    def aquecer(self) -> dict:
+        """Monta o manifesto e o index.html (etapa do aquecimento, fora do event loop)"""
+        self.index()
+        return {"arquivos": len(self._hashes)}
+
+    def hash_de(self, caminho_relativo: str) -> str | None:
+        self._atualizar()
+        return self._hashes.get(caminho_relativo)
+
+    def url(self, caminho_relativo: str) -> str:
+        versao = self.hash_de(caminho_relativo)
+        return f"/static/{caminho_relativo}?v={versao}" if versao else f"/static/{caminho_relativo}"
+
+    def index(self) -> tuple[str, str]:
+        """(html, etag) do index.html com URLs versionadas e import map"""
+        self._atualizar()
+        if self._index is not None:
+            return self._index
+
+        html = (self.static_dir / "index.html").read_text(encoding="utf-8")
+        html = _REF_ESTATICA.sub(lambda m: f'{m.group(1)}="{self.url(m.group(2))}"', html)
+
+        # Os módulos importam "./api.js"; o import map leva cada um para a URL versionada
+        modulos = {
+            f"/static/{rel}": self.url(rel)
+            for rel in self._hashes if rel.endswith(".js")
+        }
+        import_map = f'<script type="importmap">{json.dumps({"imports": modulos})}</script>\n'
+        html = html.replace('<script type="module"', import_map + '<script type="module"', 1)
+
+        etag = '"' + hashlib.sha256(html.encode("utf-8")).hexdigest()[:16] + '"'
+        self._index = (html, etag)
+        return self._index
+
+
+manifest = AssetManifest(STATIC_DIR)
+
+
+def index_response(request: Request) -> Response:
+    html, etag = manifest.index()
+    headers = {"ETag": etag, "Cache-Control": CACHE_REVALIDAR}
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    return HTMLResponse(html, headers=headers)
+
+
+class CachedStaticFiles(StaticFiles):
+    """StaticFiles com Cache-Control: imutável quando ?v= confere com o hash atual"""
+
+    def file_response(self, full_path, stat_result, scope, status_code: int = 200) -> Response:
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        rel = Path(full_path).resolve().relative_to(Path(self.directory).resolve()).as_posix()
+        versao = Request(scope).query_params.get("v")
+        if versao and versao == manifest.hash_de(rel):
+            response.headers["Cache-Control"] = CACHE_IMUTAVEL
+        else:
+            response.headers["Cache-Control"] = CACHE_REVALIDAR
+        return response
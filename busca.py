@@ -0,0 +1,155 @@
+"""
+Busca de produtos em várias raízes
+Todas as raízes do compartilhamento são consultadas ao mesmo tempo, com um prazo.
+Uma raiz lenta ou fora do ar não segura a resposta: sai marcada como "prazo" e a
+busca volta como parcial. A latência de cada raiz fica registrada para mostrar
+qual servidor de arquivos está lento.
+
+Uma chamada de rede presa numa thread não pode ser interrompida: a raiz que perdeu
+o prazo continua até terminar (ocupando sua vaga no pool), só não é mais esperada.
+Enquanto essa busca atrasada não termina, a raiz não é percorrida de novo: as buscas
+seguintes já a marcam como "prazo", sem ocupar mais threads com a mesma raiz presa.
+"""
+
+import asyncio
+import os
+import time
+from collections import deque
+from datetime import datetime
+
+from executor import PoolSaturado
+from metricas import percentil
+
+# Espera máxima por raiz, em segundos
+PRAZO_S = float(os.environ.get("FASTPRINT_BUSCA_PRAZO_S", 5))
+
+# Pastas de categoria de uma raiz percorridas ao mesmo tempo (threads do pool de compartilhamento)
+PARALELO_RAIZ = int(os.environ.get("FASTPRINT_BUSCA_PARALELO", 3))
+
+
+class _MetricasRaiz:
+    def __init__(self, raiz: str):
+        self.raiz = raiz
+        self.latencias = deque(maxlen=200)   # ms até a raiz responder (inclusive depois do prazo)
+        self.contagem = {"ok": 0, "prazo": 0, "erro": 0, "indisponivel": 0, "saturado": 0}
+        self.em_andamento = 0
+        self.atrasadas = 0   # buscas que perderam o prazo e ainda estão rodando
+        self.ultimo_erro = None
+
+    def metricas(self) -> dict:
+        latencias = list(self.latencias)
+        return {
+            "raiz": self.raiz,
+            **self.contagem,
+            "em_andamento": self.em_andamento,
+            "atrasadas": self.atrasadas,
+            "latencia_ms": {
+                "p50": percentil(latencias, 50),
+                "p95": percentil(latencias, 95),
+                "max": max(latencias) if latencias else None,
+                "amostras": len(latencias),
+            },
+            "ultimo_erro": self.ultimo_erro,
+        }
+
+
+class BuscaRaizes:
+    def __init__(self, prazo_s: float = PRAZO_S):
+        self.prazo_s = prazo_s
+        self._raizes: dict[str, _MetricasRaiz] = {}
+
+    def _metricas(self, raiz: str) -> _MetricasRaiz:
+        m = self._raizes.get(raiz)
+        if m is None:
+            m = self._raizes[raiz] = _MetricasRaiz(raiz)
+        return m
+
+    async def _medir(self, raiz: str, buscar):
+        m = self._metricas(raiz)
+        m.em_andamento += 1
+        inicio = time.perf_counter()
+        try:
+            return await buscar(raiz)
+        except FileNotFoundError:
+            m.contagem["indisponivel"] += 1
+            raise
+        except PoolSaturado:
+            raise  # falta de vaga no servidor, não problema da raiz
+        except Exception as e:
+            m.contagem["erro"] += 1
+            m.ultimo_erro = {"erro": str(e) or type(e).__name__, "em": datetime.now().isoformat(timespec="seconds")}
+            raise
+        finally:
+            m.em_andamento -= 1
+            m.latencias.append(round((time.perf_counter() - inicio) * 1000, 1))
+
+    async def executar(self, raizes: list[str], buscar) -> tuple[list, list[dict]]:
+        """
+        Roda a coroutine `buscar(raiz)` (devolve uma lista) em todas as raízes e espera até o prazo.
+        Devolve (itens das raízes que responderam, situação de cada raiz).
+        Uma raiz sem vaga no pool sai como "saturado", com o resultado das outras; só levanta
+        PoolSaturado se nenhuma raiz respondeu.
+        """
+        if not raizes:
+            return [], []
+        inicio = time.perf_counter()
+        # Raiz com busca anterior ainda presa: não abre outra, sai direto como "prazo"
+        presas = [raiz for raiz in raizes if self._metricas(raiz).atrasadas > 0]
+        tarefas = {
+            asyncio.create_task(self._medir(raiz, buscar)): raiz
+            for raiz in raizes if raiz not in presas
+        }
+        situacao = []
+        for raiz in presas:
+            self._metricas(raiz).contagem["prazo"] += 1
+            situacao.append({"raiz": raiz, "status": "prazo", "ms": 0})
+        if not tarefas:
+            return [], situacao
+        fim = {}
+        for tarefa in tarefas:
+            tarefa.add_done_callback(lambda t: fim.setdefault(t, time.perf_counter()))
+        _, pendentes = await asyncio.wait(tarefas, timeout=self.prazo_s)
+        decorrido_ms = round((time.perf_counter() - inicio) * 1000, 1)
+
+        itens, saturado = [], None
+        for tarefa, raiz in tarefas.items():
+            if tarefa in pendentes:
+                # Segue em segundo plano até terminar; a raiz fica marcada como presa até lá.
+                # A exceção, se vier, é consumida aqui para não virar aviso no log
+                m = self._metricas(raiz)
+                m.atrasadas += 1
+                m.contagem["prazo"] += 1
+
+                def _terminou(t, m=m):
+                    m.atrasadas -= 1
+                    t.cancelled() or t.exception()
+
+                tarefa.add_done_callback(_terminou)
+                situacao.append({"raiz": raiz, "status": "prazo", "ms": decorrido_ms})
+                continue
+
+            ms = round((fim.get(tarefa, time.perf_counter()) - inicio) * 1000, 1)
+            erro = tarefa.exception()
+            if erro is None:
+                self._metricas(raiz).contagem["ok"] += 1
+                itens.extend(tarefa.result())
+                situacao.append({"raiz": raiz, "status": "ok", "ms": ms})
+            elif isinstance(erro, PoolSaturado):
+                saturado = erro
+                self._metricas(raiz).contagem["saturado"] += 1
+                situacao.append({"raiz": raiz, "status": "saturado", "ms": ms})
+            elif isinstance(erro, FileNotFoundError):
+                situacao.append({"raiz": raiz, "status": "indisponivel", "ms": ms})
+            else:
+                situacao.append({"raiz": raiz, "status": "erro", "ms": ms, "erro": str(erro)})
+
+        if saturado and not any(s["status"] == "ok" for s in situacao):
+            raise saturado
+        return itens, situacao
+
+    def metricas(self) -> dict:
+        return {
+            "prazo_s": self.prazo_s,
+            "paralelo_por_raiz": PARALELO_RAIZ,
+            "raizes": [m.metricas() for m in self._raizes.values()],
+        }
@@ -0,0 +1,67 @@
+"""
+Cache local por processo com invalidação entre workers
+Cada worker guarda seus valores em memória; a versão do namespace fica no banco
+(tabela cache_versao), então invalidar em um worker derruba o cache de todos.
+"""
+
+import threading
+import time
+
+from database import versao_cache, incrementar_versao_cache
+
+
+class SharedCache:
+    """
+    Cache chave → valor com TTL. A versão no banco é consultada no máximo
+    a cada `checagem` segundos, para não transformar cada leitura numa query.
+    """
+
+    def __init__(self, namespace: str, ttl: float, checagem: float = 2.0):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.checagem = checagem
+        self._dados: dict = {}
+        self._lock = threading.Lock()
+        self._versao = None
+        self._ultima_checagem = 0.0
+
+    def _sincronizar(self):
+        agora = time.monotonic()
+        if agora - self._ultima_checagem < self.checagem:
+            return
+        versao = versao_cache(self.namespace)
+        with self._lock:
+            self._ultima_checagem = agora
+            if versao != self._versao:
+                self._dados.clear()
+                self._versao = versao
+
+    def get(self, chave, default=None):
+        self._sincronizar()
+        with self._lock:
+            item = self._dados.get(chave)
+            if item is None:
+                return default
+            valor, expira = item
+            if time.monotonic() >= expira:
+                del self._dados[chave]
+                return default
+            return valor
+
+    def set(self, chave, valor):
+        with self._lock:
+            self._dados[chave] = (valor, time.monotonic() + self.ttl)
+
+    def invalidate(self):
+        """Limpa este processo e sinaliza os demais via banco"""
+        versao = incrementar_versao_cache(self.namespace)
+        with self._lock:
+            self._dados.clear()
+            self._versao = versao
+            self._ultima_checagem = time.monotonic()
+
+
+printers_cache = SharedCache("impressoras", ttl=300)
+scan_cache = SharedCache("varredura", ttl=30)
+# Subpastas das raízes de busca e das categorias (o catálogo muda pouco; a listagem no compartilhamento é lenta)
+catalog_cache = SharedCache("catalogo", ttl=120)
@@ -0,0 +1,344 @@
+"""
+Teste de carga com operadores simultâneos
+Sobe o app de verdade no próprio processo (httpx + ASGI, com o lifespan) contra uma
+árvore de compartilhamento gerada e uma impressora de mentira, e simula N terminais
+do chão de fábrica: login, busca de produto, navegação, listagem de PDFs, impressão
+e atualização do rastreio. Gera um relatório JSON com vazão e latência p50/p95/p99
+por endpoint e o atraso do event loop, para comparar entre versões.
+
+Cliente e servidor dividem o mesmo event loop: o número mostra a capacidade de um
+worker com tudo junto, não a de rede. O atraso do event loop é o indicador de que
+alguma rota está bloqueando o loop.
+
+Uso:
+    python carga.py --operadores 40 --duracao 60 --saida carga.json
+    python carga.py --operadores 40 --comparar carga_anterior.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime
+from pathlib import Path
+
+from metricas import percentil
+
+# Mix de ações de um operador (peso relativo)
+MIX = {
+    "busca": 30,
+    "navegar": 15,
+    "listar_pdfs": 20,
+    "imprimir": 10,
+    "rastreio_busca": 15,
+    "rastreio_documento": 5,
+    "rastreio_fase": 5,
+}
+
+# PDF mínimo válido (uma página em branco), para o carimbo ter o que abrir
+PDF_MINIMO = (
+    b"%PDF-1.4\n1 0 obj<</Type/Catalog/Pages 2 0 R>>endobj\n"
+    b"2 0 obj<</Type/Pages/Kids[3 0 R]/Count 1>>endobj\n"
+    b"3 0 obj<</Type/Page/Parent 2 0 R/MediaBox[0 0 595 842]>>endobj\n"
+    b"trailer<</Root 1 0 R>>\n%%EOF\n"
+)
+
+
+def gerar_compartilhamento(raiz: Path, produtos: int, pdfs: int) -> tuple[list[str], list[str]]:
+    """
+    Duas raízes no formato do compartilhamento real (status → [categoria →] produto → ENG*),
+    com metade dos produtos dentro de pastas de categoria. Devolve (raízes, produtos).
+    """
+    raizes = [raiz / "1 - EM LINHA", raiz / "3 - EM REVISAO"]
+    caminhos = []
+    for n in range(produtos):
+        status = raizes[n % 2]
+        nome = f"{510000000 + n} - PRODUTO CARGA {n}"
+        produto = status / nome if n % 4 < 2 else status / f"CATEGORIA {n % 5}" / nome
+        eng = produto / "ENG - 001 - DESENHOS"
+        eng.mkdir(parents=True, exist_ok=True)
+        for i in range(pdfs):
+            (eng / f"ENG - {n:03d} - {i:04d} - PECA - V0.pdf").write_bytes(PDF_MINIMO)
+        (produto / "ENG - 002 - OBSOLETO").mkdir(exist_ok=True)
+        caminhos.append(str(produto))
+    return [str(r) for r in raizes], caminhos
+
+
+def resumo_latencias(valores_ms: list[float]) -> dict:
+    return {
+        "p50": _ms(percentil(valores_ms, 50)),
+        "p95": _ms(percentil(valores_ms, 95)),
+        "p99": _ms(percentil(valores_ms, 99)),
+        "max": _ms(max(valores_ms)) if valores_ms else None,
+        "media": _ms(sum(valores_ms) / len(valores_ms)) if valores_ms else None,
+    }
+
+
+def _ms(v: float | None) -> float | None:
+    return round(v, 2) if v is not None else None
+
+
+class Medicoes:
+    def __init__(self):
+        self.latencias: dict[str, list[float]] = defaultdict(list)
+        self.status: dict[str, dict[int, int]] = defaultdict(lambda: defaultdict(int))
+        self.excecoes: dict[str, int] = defaultdict(int)
+        self.atraso_loop: list[float] = []
+
+    def registrar(self, endpoint: str, inicio: float, status: int | None):
+        self.latencias[endpoint].append((time.perf_counter() - inicio) * 1000)
+        if status is None:
+            self.excecoes[endpoint] += 1
+        else:
+            self.status[endpoint][status] += 1
+
+
+async def monitorar_loop(medicoes: Medicoes, intervalo: float = 0.05):
+    """Quanto cada sleep curto atrasa além do pedido = tempo em que o loop ficou ocupado"""
+    while True:
+        inicio = time.perf_counter()
+        await asyncio.sleep(intervalo)
+        medicoes.atraso_loop.append(max(0.0, (time.perf_counter() - inicio - intervalo) * 1000))
+
+
+class Operador:
+    def __init__(self, n: int, client, medicoes: Medicoes, raizes: list[str], produtos: list[str],
+                 impressora: str, pausa_s: float, rng: random.Random):
+        self.n = n
+        self.client = client
+        self.medicoes = medicoes
+        self.raizes = raizes
+        self.produtos = produtos
+        self.impressora = impressora
+        self.pausa_s = pausa_s
+        self.rng = rng
+        self.headers = {}
+        self.codigos: list[str] = []
+
+    async def _req(self, endpoint: str, metodo: str, url: str, **kwargs):
+        inicio = time.perf_counter()
+        try:
+            resp = await self.client.request(metodo, url, headers=self.headers, **kwargs)
+        except Exception:
+            self.medicoes.registrar(endpoint, inicio, None)
+            return None
+        self.medicoes.registrar(endpoint, inicio, resp.status_code)
+        return resp
+
+    async def login(self):
+        resp = await self._req("login", "POST", "/api/login",
+                               json={"usuario": f"operador{self.n}", "senha": "carga"})
+        if resp is not None and resp.status_code == 200:
+            self.headers = {"Authorization": f"Bearer {resp.json()['token']}"}
+
+    def _produto(self) -> str:
+        return self.rng.choice(self.produtos)
+
+    async def busca(self):
+        numero = Path(self._produto()).name.split(" - ")[0]
+        # Parte do número, como o operador digita
+        await self._req("busca", "GET", "/api/search", params={"query": numero[-self.rng.randint(3, 6):]})
+
+    async def navegar(self):
+        destino = self.rng.choice(self.raizes + [self._produto()])
+        await self._req("navegar", "GET", "/api/browse", params={"path": destino})
+
+    async def listar_pdfs(self):
+        if self.rng.random() < 0.5:
+            await self._req("listar_pdfs", "POST", "/api/list-pdfs", json={"path": self._produto()})
+        else:
+            await self._req("listar_pdfs_stream", "POST", "/api/list-pdfs/stream", json={"path": self._produto()})
+
+    async def imprimir(self):
+        produto = Path(self._produto())
+        pdfs = sorted(str(p) for p in produto.rglob("*.pdf"))
+        selecionados = self.rng.sample(pdfs, min(len(pdfs), self.rng.randint(1, 5)))
+        resp = await self._req("imprimir", "POST", "/api/print", json={
+            "folder_path": str(produto),
+            "printer": self.impressora,
+            "selected_files": selecionados,
+            "fase": self.rng.choice(["Lote Teste", "Lote Piloto", "Lote Padrão"]),
+            "urgente": self.rng.random() < 0.1,
+        })
+        if resp is not None and resp.status_code == 200:
+            self.codigos.extend(resp.json().get("codigos_rastreio", []))
+            del self.codigos[:-50]
+
+    async def rastreio_busca(self):
+        termo = self.rng.choice(["PRODUTO", "PECA", "CARGA", Path(self._produto()).name.split(" - ")[0]])
+        await self._req("rastreio_busca", "GET", "/api/documentos/busca", params={"q": termo})
+
+    async def rastreio_documento(self):
+        if not self.codigos:
+            return await self.rastreio_busca()
+        await self._req("rastreio_documento", "GET", f"/api/documentos/{self.rng.choice(self.codigos)}")
+
+    async def rastreio_fase(self):
+        if not self.codigos:
+            return await self.rastreio_busca()
+        await self._req("rastreio_fase", "POST", "/api/documentos/fase", json={
+            "codigo_rastreio": self.rng.choice(self.codigos),
+            "fase": self.rng.choice(["Lote Piloto", "Lote Padrão"]),
+            "por_produto": self.rng.random() < 0.2,
+        })
+
+    async def executar(self, ate: float):
+        await self.login()
+        acoes = list(MIX)
+        pesos = list(MIX.values())
+        while time.perf_counter() < ate:
+            await getattr(self, self.rng.choices(acoes, pesos)[0])()
+            # Tempo de "leitura" do operador entre uma ação e outra
+            await asyncio.sleep(self.rng.expovariate(1 / self.pausa_s) if self.pausa_s else 0)
+
+
+def preparar_app(args, raizes: list[str]):
+    """Importa o app com banco temporário, compartilhamento gerado e impressora de mentira"""
+    import main as servidor
+
+    servidor.SEARCH_PATHS[:] = raizes
+
+    def print_pdf(pdf_path, printer=None):
+        # Spooler simulado: ocupa a thread do pool como a impressão real
+        time.sleep(args.impressao_ms / 1000)
+        return {"success": True, "message": f"Enviado para impressão: {Path(pdf_path).name}"}
+
+    servidor.print_pdf = print_pdf
+    servidor._discover_printers = lambda: ["Carga"]
+    return servidor
+
+
+async def executar(args) -> dict:
+    import httpx
+
+    servidor = preparar_app(args, args.raizes)
+    import database
+    from executor import share_pool, db_pool
+
+    medicoes = Medicoes()
+    rng = random.Random(args.semente)
+
+    async with servidor.app.router.lifespan_context(servidor.app):
+        for n in range(args.operadores):
+            database.criar_usuario(f"Operador {n}", f"operador{n}", "carga")
+
+        # Cada operador é um terminal (IP) diferente, como no revezamento da fila
+        clientes = [
+            httpx.AsyncClient(transport=httpx.ASGITransport(app=servidor.app, client=(f"10.0.{n // 250}.{n % 250 + 1}", 50000)),
+                              base_url="http://fastprint", timeout=None)
+            for n in range(args.operadores)
+        ]
+        operadores = [
+            Operador(n, clientes[n], medicoes, args.raizes, args.produtos_gerados, "Carga", args.pausa_s,
+                     random.Random(rng.random()))
+            for n in range(args.operadores)
+        ]
+
+        monitor = asyncio.create_task(monitorar_loop(medicoes))
+        inicio = time.perf_counter()
+        ate = inicio + args.duracao
+        await asyncio.gather(*(op.executar(ate) for op in operadores))
+        duracao = time.perf_counter() - inicio
+        monitor.cancel()
+
+        fila = servidor.print_scheduler.metricas()
+        busca = servidor.busca_raizes.metricas()
+        pools = [share_pool.status(), db_pool.status()]
+        for c in clientes:
+            await c.aclose()
+
+    endpoints = {}
+    for endpoint in sorted(medicoes.latencias):
+        lat = medicoes.latencias[endpoint]
+        status = medicoes.status[endpoint]
+        ok = sum(v for s, v in status.items() if 200 <= s < 300)
+        endpoints[endpoint] = {
+            "requisicoes": len(lat),
+            "por_segundo": round(len(lat) / duracao, 2),
+            "ok": ok,
+            "recusadas": status.get(429, 0) + status.get(503, 0),
+            "erros": len(lat) - ok - status.get(429, 0) - status.get(503, 0),
+            "status": {str(s): v for s, v in sorted(status.items())},
+            "latencia_ms": resumo_latencias(lat),
+        }
+    total = sum(e["requisicoes"] for e in endpoints.values())
+    todas = [v for lat in medicoes.latencias.values() for v in lat]
+
+    return {
+        "gerado_em": datetime.now().isoformat(timespec="seconds"),
+        "config": {
+            "operadores": args.operadores, "duracao_s": args.duracao, "pausa_s": args.pausa_s,
+            "produtos": args.produtos, "pdfs_por_produto": args.pdfs, "impressao_ms": args.impressao_ms,
+            "semente": args.semente,
+            "share_workers": share_pool.max_workers, "db_workers": db_pool.max_workers,
+        },
+        "duracao_s": round(duracao, 2),
+        "requisicoes": total,
+        "por_segundo": round(total / duracao, 2),
+        "latencia_ms": resumo_latencias(todas),
+        "endpoints": endpoints,
+        "atraso_loop_ms": {**resumo_latencias(medicoes.atraso_loop), "amostras": len(medicoes.atraso_loop)},
+        "fila_impressao": fila,
+        "busca_raizes": busca,
+        "pools": pools,
+    }
+
+
+def imprimir_relatorio(relatorio: dict, anterior: dict | None):
+    print(f"\n{relatorio['requisicoes']} requisições em {relatorio['duracao_s']}s "
+          f"({relatorio['por_segundo']}/s) com {relatorio['config']['operadores']} operadores\n")
+    cabecalho = f"{'endpoint':<20}{'req':>7}{'/s':>8}{'erros':>7}{'recus.':>7}{'p50':>9}{'p95':>9}{'p99':>9}"
+    if anterior:
+        cabecalho += f"{'p95 ant.':>10}{'Δp95':>8}"
+    print(cabecalho)
+    for nome, e in relatorio["endpoints"].items():
+        lat = e["latencia_ms"]
+        linha = (f"{nome:<20}{e['requisicoes']:>7}{e['por_segundo']:>8}{e['erros']:>7}{e['recusadas']:>7}"
+                 f"{lat['p50']:>9}{lat['p95']:>9}{lat['p99']:>9}")
+        antes = (anterior or {}).get("endpoints", {}).get(nome)
+        if antes and antes["latencia_ms"]["p95"]:
+            p95_antes = antes["latencia_ms"]["p95"]
+            linha += f"{p95_antes:>10}{(lat['p95'] / p95_antes - 1) * 100:>+7.0f}%"
+        print(linha)
+    lag = relatorio["atraso_loop_ms"]
+    print(f"\nAtraso do event loop (ms): p50 {lag['p50']} | p95 {lag['p95']} | p99 {lag['p99']} | max {lag['max']}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--operadores", type=int, default=20, help="terminais simultâneos")
+    parser.add_argument("--duracao", type=float, default=30, help="segundos de carga")
+    parser.add_argument("--pausa-s", type=float, default=0.5, help="pausa média entre ações de um operador (0 = sem pausa)")
+    parser.add_argument("--produtos", type=int, default=200, help="produtos no compartilhamento gerado")
+    parser.add_argument("--pdfs", type=int, default=30, help="PDFs por produto")
+    parser.add_argument("--impressao-ms", type=float, default=200, help="tempo simulado do spooler por arquivo")
+    parser.add_argument("--semente", type=int, default=1)
+    parser.add_argument("--saida", help="grava o relatório JSON neste arquivo")
+    parser.add_argument("--comparar", help="relatório JSON anterior para comparar o p95")
+    args = parser.parse_args()
+
+    anterior = json.loads(Path(args.comparar).read_text(encoding="utf-8")) if args.comparar else None
+
+    tmpdir = Path(tempfile.mkdtemp(prefix="fp_carga_"))
+    # O banco é escolhido por variável de ambiente antes de importar database/main
+    os.environ["FASTPRINT_DB"] = str(tmpdir / "carga.db")
+    os.environ.pop("FASTPRINT_SMTP_HOST", None)
+    print(f"Gerando compartilhamento em {tmpdir} ({args.produtos} produtos × {args.pdfs} PDFs)...")
+    args.raizes, args.produtos_gerados = gerar_compartilhamento(tmpdir / "share", args.produtos, args.pdfs)
+
+    relatorio = asyncio.run(executar(args))
+    imprimir_relatorio(relatorio, anterior)
+
+    if args.saida:
+        Path(args.saida).write_text(json.dumps(relatorio, indent=2, ensure_ascii=False), encoding="utf-8")
+        print(f"\nRelatório: {args.saida}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
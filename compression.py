@@ -0,0 +1,132 @@
+"""
+Compressão HTTP negociada (brotli ou gzip)
+Comprime respostas de texto/JSON acima de um tamanho mínimo. Respostas em
+streaming (NDJSON) são comprimidas pedaço a pedaço com flush, para que cada
+registro continue chegando ao navegador assim que é gerado.
+"""
+
+import zlib
+
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+except ImportError:  # opcional: sem o pacote, só gzip
+    brotli = None
+
+TIPOS_COMPRIMIVEIS = (
+    "text/", "application/json", "application/javascript",
+    "application/x-ndjson", "image/svg+xml",
+)
+
+
+def _aceitas(accept_encoding: str) -> set[str]:
+    aceitas = set()
+    for parte in accept_encoding.lower().split(","):
+        nome, _, params = parte.partition(";")
+        params = params.strip()
+        q = 1.0
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                pass
+        if q > 0:
+            aceitas.add(nome.strip())
+    return aceitas
+
+
+class _Gzip:
+    def __init__(self, nivel: int):
+        self._z = zlib.compressobj(nivel, zlib.DEFLATED, 31)  # 31 = cabeçalho gzip
+
+    def comprimir(self, dados: bytes, fim: bool) -> bytes:
+        saida = self._z.compress(dados)
+        return saida + self._z.flush(zlib.Z_FINISH if fim else zlib.Z_SYNC_FLUSH)
+
+
+class _Brotli:
+    def __init__(self, nivel: int):
+        self._b = brotli.Compressor(quality=nivel)
+
+    def comprimir(self, dados: bytes, fim: bool) -> bytes:
+        saida = self._b.process(dados)
+        return saida + (self._b.finish() if fim else self._b.flush())
+
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 5):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    def _codificador(self, scope):
+        aceitas = _aceitas(Headers(scope=scope).get("accept-encoding", ""))
+        if brotli is not None and "br" in aceitas:
+            return "br", lambda: _Brotli(self.brotli_quality)
+        if "gzip" in aceitas:
+            return "gzip", lambda: _Gzip(self.gzip_level)
+        return None, None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding, novo_compressor = self._codificador(scope)
+        inicio = None          # http.response.start retido até ver o primeiro corpo
+        compressor = None
+        passar = False
+
+        async def enviar(message):
+            nonlocal inicio, compressor, passar
+
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                tipo = headers.get("content-type", "")
+                comprimivel = (message["status"] == 200 and "content-encoding" not in headers
+                               and tipo.startswith(TIPOS_COMPRIMIVEIS))
+                if comprimivel:
+                    MutableHeaders(raw=message["headers"]).add_vary_header("Accept-Encoding")
+                if not comprimivel or encoding is None:
+                    passar = True
+                    await send(message)
+                    return
+                inicio = message
+                return
+
+            if passar or message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            corpo = message.get("body", b"")
+            mais = message.get("more_body", False)
+
+            if inicio is not None:
+                start, inicio = inicio, None
+                if not mais and len(corpo) < self.minimum_size:
+                    # Pequeno demais para compensar: segue como está
+                    passar = True
+                    await send(start)
+                    await send(message)
+                    return
+                headers = MutableHeaders(raw=start["headers"])
+                headers["Content-Encoding"] = encoding
+                if "content-length" in headers:
+                    del headers["Content-Length"]
+                etag = headers.get("etag")
+                if etag and not etag.startswith("W/"):
+                    headers["ETag"] = "W/" + etag  # o corpo não é mais byte a byte o original
+                compressor = novo_compressor()
+                dados = compressor.comprimir(corpo, fim=not mais)
+                if not mais:
+                    headers["Content-Length"] = str(len(dados))
+                await send(start)
+                await send({"type": "http.response.body", "body": dados, "more_body": mais})
+                return
+
+            await send({"type": "http.response.body", "body": compressor.comprimir(corpo, fim=not mais),
+                        "more_body": mais})
+
+        await self.app(scope, receive, enviar)
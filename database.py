@@ -3,26 +3,73 @@ Banco de Dados
 Gerencia usuários, logs de impressão e rastreio de documentos
 """
 
+import os
+import re
+import json
 import sqlite3
+from contextlib import contextmanager
 from pathlib import Path
-from datetime import datetime
+from datetime import datetime, timedelta
 from werkzeug.security import generate_password_hash, check_password_hash
 
-DB_PATH = Path(__file__).parent / "fastprint.db"
+DB_PATH = Path(os.environ.get("FASTPRINT_DB") or Path(__file__).parent / "fastprint.db")
+
+# Arquivos mensais com documentos baixados e logs antigos (fastprint-AAAA-MM.db)
+ARQUIVO_DIR = Path(os.environ.get("FASTPRINT_ARQUIVO_DIR") or DB_PATH.parent / "arquivo")
+
+# Idade mínima (dias) para um documento baixado ou log sair do banco principal
+RETENCAO_DIAS = int(os.environ.get("FASTPRINT_RETENCAO_DIAS", 180))
+
+# E-mails avisados quando a fase de um documento muda (separados por vírgula)
+DESTINATARIOS_FASE = [e.strip() for e in os.environ.get("FASTPRINT_NOTIFICAR_FASE", "").split(",") if e.strip()]
+
+# Espera pelo lock de escrita quando vários workers gravam ao mesmo tempo
+BUSY_TIMEOUT_S = 30
 
 def get_connection():
     """Retorna conexão com o banco"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = sqlite3.connect(DB_PATH, timeout=BUSY_TIMEOUT_S)
     conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA synchronous = NORMAL")
     return conn
 
-def init_db():
-    """Cria as tabelas se não existirem"""
+@contextmanager
+def transacao():
+    """
+    Conexão dentro de BEGIN IMMEDIATE: o lock de escrita é obtido logo no início,
+    então escritores concorrentes (outros workers) esperam na fila do busy_timeout
+    em vez de falhar com "database is locked" ao promover o lock no meio da transação.
+    """
     conn = get_connection()
-    cursor = conn.cursor()
-    
+    conn.isolation_level = None
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        yield conn
+        conn.execute("COMMIT")
+    except BaseException:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+# Linhas do índice de texto: nomes de quem imprimiu/recolheu/baixou numa só coluna
+_SELECT_FTS = """
+    SELECT d.id, d.codigo_rastreio, d.produto, d.arquivo, d.pasta,
+           trim(coalesce(u1.nome, '') || ' ' || coalesce(u2.nome, '') || ' ' || coalesce(u3.nome, ''))
+    FROM documentos_impressos d
+    LEFT JOIN usuarios u1 ON d.impresso_por_id = u1.id
+    LEFT JOIN usuarios u2 ON d.recolhido_por_id = u2.id
+    LEFT JOIN usuarios u3 ON d.baixado_por_id = u3.id
+"""
+
+def _tem_coluna(conn, tabela: str, coluna: str) -> bool:
+    return any(r["name"] == coluna for r in conn.execute(f"PRAGMA table_info({tabela})"))
+
+def _migracao_1_tabelas(conn):
+    """Tabelas originais"""
     # Tabela de usuários
-    cursor.execute("""
+    conn.execute("""
         CREATE TABLE IF NOT EXISTS usuarios (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             nome TEXT NOT NULL,
@@ -32,9 +79,9 @@ def init_db():
             criado_em TEXT DEFAULT CURRENT_TIMESTAMP
         )
     """)
-    
+
     # Tabela de logs (mantida para compatibilidade)
-    cursor.execute("""
+    conn.execute("""
         CREATE TABLE IF NOT EXISTS logs (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             usuario_id INTEGER NOT NULL,
@@ -49,7 +96,7 @@ def init_db():
     """)
 
     # Tabela de documentos impressos (rastreio)
-    cursor.execute("""
+    conn.execute("""
         CREATE TABLE IF NOT EXISTS documentos_impressos (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             codigo_rastreio TEXT UNIQUE NOT NULL,
@@ -72,22 +119,115 @@ def init_db():
     """)
 
     # Contador diário para código de rastreio
-    cursor.execute("""
+    conn.execute("""
         CREATE TABLE IF NOT EXISTS contador_rastreio (
             data TEXT PRIMARY KEY,
             contador INTEGER DEFAULT 0
         )
     """)
-    
-    # Migration: coluna fase (caso banco já exista sem ela)
-    try:
-        cursor.execute("ALTER TABLE documentos_impressos ADD COLUMN fase TEXT DEFAULT NULL")
-        conn.commit()
-    except sqlite3.OperationalError:
-        pass  # coluna já existe
 
-    conn.commit()
+def _migracao_2_fase(conn):
+    """Coluna fase (bancos antigos podem já tê-la, da migração feita antes do versionamento)"""
+    if not _tem_coluna(conn, "documentos_impressos", "fase"):
+        conn.execute("ALTER TABLE documentos_impressos ADD COLUMN fase TEXT DEFAULT NULL")
+
+def _migracao_3_indices_cache(conn):
+    # Índices das consultas por data/status (listagens, arquivamento)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_logs_data ON logs(data)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_docs_impresso_em ON documentos_impressos(impresso_em)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_docs_status_baixado ON documentos_impressos(status, baixado_em)")
+
+    # Versão por namespace de cache, para invalidar caches locais de todos os workers
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS cache_versao (
+            namespace TEXT PRIMARY KEY,
+            versao INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+
+def _migracao_4_busca_texto(conn):
+    # Índice de texto do rastreio (rowid = documentos_impressos.id)
+    conn.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS documentos_fts USING fts5(
+            codigo_rastreio, produto, arquivo, pasta, usuarios,
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3'
+        )
+    """)
+    conn.execute("DELETE FROM documentos_fts")
+    conn.execute(f"INSERT INTO documentos_fts (rowid, codigo_rastreio, produto, arquivo, pasta, usuarios) {_SELECT_FTS}")
+
+def _migracao_5_outbox(conn):
+    # Notificações gravadas na mesma transação da mudança e enviadas depois, em segundo plano
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS notificacoes_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            evento TEXT NOT NULL,
+            produto TEXT NOT NULL,
+            destinatario TEXT NOT NULL,
+            dados TEXT NOT NULL,
+            criado_em TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pendente',
+            tentativas INTEGER NOT NULL DEFAULT 0,
+            proxima_tentativa TEXT NOT NULL,
+            enviado_em TEXT,
+            erro TEXT
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_fila ON notificacoes_outbox(status, proxima_tentativa)")
+
+def _migracao_6_assinatura_arquivo(conn):
+    # Assinatura do PDF no momento da impressão, para reimprimir só o que mudou
+    for coluna, tipo in (("arquivo_tamanho", "INTEGER"), ("arquivo_mtime_ns", "INTEGER"), ("arquivo_sha256", "TEXT")):
+        if not _tem_coluna(conn, "documentos_impressos", coluna):
+            conn.execute(f"ALTER TABLE documentos_impressos ADD COLUMN {coluna} {tipo}")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_docs_produto_arquivo ON documentos_impressos(produto, arquivo)")
+
+def _migracao_7_arquivo_relativo(conn):
+    # Caminho do PDF relativo à pasta do produto: o mesmo nome pode existir em duas pastas ENG
+    if not _tem_coluna(conn, "documentos_impressos", "arquivo_relativo"):
+        conn.execute("ALTER TABLE documentos_impressos ADD COLUMN arquivo_relativo TEXT")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_docs_produto_relativo ON documentos_impressos(produto, arquivo_relativo)")
+
+# Migrações em ordem; o número aplicado fica em PRAGMA user_version.
+# Para mudar o schema, acrescente uma função no fim — nunca altere as já publicadas.
+MIGRACOES = [
+    _migracao_1_tabelas,
+    _migracao_2_fase,
+    _migracao_3_indices_cache,
+    _migracao_4_busca_texto,
+    _migracao_5_outbox,
+    _migracao_6_assinatura_arquivo,
+    _migracao_7_arquivo_relativo,
+]
+
+def versao_schema() -> int:
+    conn = get_connection()
+    versao = conn.execute("PRAGMA user_version").fetchone()[0]
     conn.close()
+    return versao
+
+def init_db() -> int:
+    """
+    Aplica as migrações pendentes e devolve quantas foram aplicadas.
+    Com o schema em dia custa uma leitura de PRAGMA. Seguro com vários workers:
+    a versão é relida sob o lock de escrita antes de migrar.
+    """
+    if versao_schema() >= len(MIGRACOES):
+        return 0
+
+    conn = get_connection()
+    # WAL permite leituras enquanto outro processo escreve (modo multi-worker).
+    # Persistente no arquivo, mas não pode ser trocado dentro de transação.
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.close()
+
+    with transacao() as conn:
+        atual = conn.execute("PRAGMA user_version").fetchone()[0]
+        for numero, migracao in enumerate(MIGRACOES[atual:], start=atual + 1):
+            migracao(conn)
+            conn.execute(f"PRAGMA user_version = {numero}")
+    return len(MIGRACOES) - atual
 
 # ============================================
 # USUÁRIOS
@@ -149,50 +289,59 @@ def ativar_usuario(usuario_id: int):
 # ============================================
 
 def registrar_log(usuario_id: int, produto: str, pasta: str, arquivos: list, impressora: str):
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        """INSERT INTO logs (usuario_id, produto, pasta, arquivos, quantidade, impressora) 
-           VALUES (?, ?, ?, ?, ?, ?)""",
-        (usuario_id, produto, pasta, ",".join(arquivos), len(arquivos), impressora)
-    )
-    conn.commit()
-    conn.close()
+    with transacao() as conn:
+        conn.execute(
+            """INSERT INTO logs (usuario_id, produto, pasta, arquivos, quantidade, impressora) 
+               VALUES (?, ?, ?, ?, ?, ?)""",
+            (usuario_id, produto, pasta, ",".join(arquivos), len(arquivos), impressora)
+        )
 
-def listar_logs(limite: int = 100):
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT l.*, u.nome as usuario_nome 
-        FROM logs l 
-        JOIN usuarios u ON l.usuario_id = u.id 
-        ORDER BY l.data DESC 
-        LIMIT ?
-    """, (limite,))
-    rows = cursor.fetchall()
-    conn.close()
-    return [dict(row) for row in rows]
+_SELECT_LOGS = """
+    SELECT l.*, u.nome as usuario_nome 
+    FROM {schema}.logs l 
+    JOIN main.usuarios u ON l.usuario_id = u.id 
+"""
+
+def listar_logs(limite: int = 100, desde: str = None, ate: str = None):
+    """Logs mais recentes. Com `desde` (AAAA-MM-DD), inclui os arquivos mensais do período."""
+    where, params = _filtro_periodo("l.data", desde, ate)
+    return _consultar_com_arquivos(_SELECT_LOGS, where + " ORDER BY l.data DESC LIMIT ?",
+                                   params, "data", limite, desde, ate)
 
 # ============================================
 # RASTREIO DE DOCUMENTOS
 # ============================================
 
+def _limpar_no(no: str) -> str:
+    # Sem truncar: PRINTSRV01 e PRINTSRV02 precisam continuar distintos
+    pc = "".join(c for c in no.upper() if c.isalnum())
+    if not pc:
+        raise ValueError(f"ID de nó inválido para o código de rastreio: {no!r}")
+    return pc
+
+def reservar_codigos_rastreio(no: str, quantidade: int) -> list[str]:
+    """
+    Reserva um bloco de códigos FP-AAAAMMDD-SEQ-NO numa única transação.
+    O incremento é atômico entre processos; o sufixo do nó mantém os códigos
+    distintos entre hosts com bancos separados.
+    """
+    if quantidade <= 0:
+        return []
+    hoje = datetime.now().strftime("%Y%m%d")
+    with transacao() as conn:
+        row = conn.execute("""
+            INSERT INTO contador_rastreio (data, contador) VALUES (?, ?)
+            ON CONFLICT(data) DO UPDATE SET contador = contador + excluded.contador
+            RETURNING contador
+        """, (hoje, quantidade)).fetchone()
+    ultimo = row["contador"]
+
+    pc = _limpar_no(no)
+    return [f"FP-{hoje}-{seq:04d}-{pc}" for seq in range(ultimo - quantidade + 1, ultimo + 1)]
+
 def gerar_codigo_rastreio(computador: str) -> str:
     """Gera código único: FP-AAAAMMDD-SEQ-PC"""
-    hoje = datetime.now().strftime("%Y%m%d")
-    conn = get_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute("INSERT OR IGNORE INTO contador_rastreio (data, contador) VALUES (?, 0)", (hoje,))
-    cursor.execute("UPDATE contador_rastreio SET contador = contador + 1 WHERE data = ?", (hoje,))
-    cursor.execute("SELECT contador FROM contador_rastreio WHERE data = ?", (hoje,))
-    seq = cursor.fetchone()["contador"]
-    conn.commit()
-    conn.close()
-    
-    # Limita e limpa o nome do computador
-    pc = "".join(c for c in computador.upper() if c.isalnum())[:8]
-    return f"FP-{hoje}-{seq:04d}-{pc}"
+    return reservar_codigos_rastreio(computador, 1)[0]
 
 def registrar_documento_impresso(
     codigo_rastreio: str,
@@ -202,104 +351,441 @@ def registrar_documento_impresso(
     impressora: str,
     computador: str,
     usuario_id: int,
-    fase: str = None
+    fase: str = None,
+    assinatura: dict = None,
+    arquivo_relativo: str = None
 ):
+    """
+    assinatura: {"tamanho", "mtime_ns", "sha256"} do PDF impresso (base do modo só alterados).
+    arquivo_relativo: caminho do PDF dentro da pasta do produto (ex.: "ENG - Mec/001.pdf").
+    """
+    assinatura = assinatura or {}
+    with transacao() as conn:
+        cursor = conn.execute("""
+            INSERT INTO documentos_impressos
+            (codigo_rastreio, produto, arquivo, pasta, impressora, computador, impresso_por_id, fase,
+             arquivo_tamanho, arquivo_mtime_ns, arquivo_sha256, arquivo_relativo)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (codigo_rastreio, produto, arquivo, pasta, impressora, computador, usuario_id, fase,
+              assinatura.get("tamanho"), assinatura.get("mtime_ns"), assinatura.get("sha256"),
+              arquivo_relativo))
+        _indexar_documento(conn, cursor.lastrowid)
+
+def ultimas_assinaturas(produto: str) -> dict[str, dict]:
+    """
+    Impressão mais recente de cada arquivo do produto, com a assinatura gravada, por
+    caminho relativo à pasta do produto. Impressões anteriores à migração 7 não têm o
+    caminho e ficam de fora (o arquivo é impresso de novo uma vez).
+    """
     conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        INSERT INTO documentos_impressos
-        (codigo_rastreio, produto, arquivo, pasta, impressora, computador, impresso_por_id, fase)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-    """, (codigo_rastreio, produto, arquivo, pasta, impressora, computador, usuario_id, fase))
-    conn.commit()
+    # Colunas soltas com MAX(): o SQLite devolve os valores da linha do máximo
+    rows = conn.execute("""
+        SELECT MAX(id) AS id, arquivo_relativo, arquivo, codigo_rastreio, impresso_em,
+               arquivo_tamanho, arquivo_mtime_ns, arquivo_sha256
+        FROM documentos_impressos
+        WHERE produto = ? AND arquivo_relativo IS NOT NULL
+        GROUP BY arquivo_relativo
+    """, (produto,)).fetchall()
     conn.close()
+    return {r["arquivo_relativo"]: dict(r) for r in rows}
 
-def listar_documentos(status: str = None, limite: int = 200):
-    conn = get_connection()
-    cursor = conn.cursor()
-    
-    query = """
-        SELECT
-            d.*,
-            u1.nome as impresso_por_nome,
-            u2.nome as recolhido_por_nome,
-            u3.nome as baixado_por_nome
-        FROM documentos_impressos d
-        JOIN usuarios u1 ON d.impresso_por_id = u1.id
-        LEFT JOIN usuarios u2 ON d.recolhido_por_id = u2.id
-        LEFT JOIN usuarios u3 ON d.baixado_por_id = u3.id
+_SELECT_DOCUMENTOS = """
+    SELECT
+        d.*,
+        u1.nome as impresso_por_nome,
+        u2.nome as recolhido_por_nome,
+        u3.nome as baixado_por_nome
+    FROM {schema}.documentos_impressos d
+    JOIN main.usuarios u1 ON d.impresso_por_id = u1.id
+    LEFT JOIN main.usuarios u2 ON d.recolhido_por_id = u2.id
+    LEFT JOIN main.usuarios u3 ON d.baixado_por_id = u3.id
+"""
+
+def listar_documentos(status: str = None, limite: int | None = 200, desde: str = None, ate: str = None):
     """
-    
+    Documentos mais recentes. Com `desde` (AAAA-MM-DD), inclui os arquivos mensais
+    do período. limite=None devolve todas as linhas (exportação).
+    """
+    where, params = _filtro_periodo("d.impresso_em", desde, ate)
     if status:
-        query += " WHERE d.status = ?"
-        cursor.execute(query + " ORDER BY d.impresso_em DESC LIMIT ?", (status, limite))
-    else:
-        cursor.execute(query + " ORDER BY d.impresso_em DESC LIMIT ?", (limite,))
-    
-    rows = cursor.fetchall()
-    conn.close()
-    return [dict(row) for row in rows]
+        where += (" AND" if where else " WHERE") + " d.status = ?"
+        params.append(status)
+    return _consultar_com_arquivos(_SELECT_DOCUMENTOS, where + " ORDER BY d.impresso_em DESC LIMIT ?",
+                                   params, "impresso_em", limite, desde, ate)
 
 def atualizar_status_documento(codigo_rastreio: str, novo_status: str, usuario_id: int) -> bool:
     """Atualiza status: recolhido ou baixado"""
-    conn = get_connection()
-    cursor = conn.cursor()
+    if novo_status != "baixado":
+        return False
+
     agora = datetime.now().isoformat()
-    
-    if novo_status == "baixado":
-        cursor.execute("""
+    with transacao() as conn:
+        cursor = conn.execute("""
             UPDATE documentos_impressos
             SET status = 'baixado', baixado_por_id = ?, baixado_em = ?
             WHERE codigo_rastreio = ? AND status = 'entregue'
         """, (usuario_id, agora, codigo_rastreio))
-    else:
-        conn.close()
-        return False
-    
-    affected = cursor.rowcount
-    conn.commit()
-    conn.close()
+        affected = cursor.rowcount
+        if affected:
+            # Quem deu baixa também é pesquisável
+            row = conn.execute("SELECT id FROM documentos_impressos WHERE codigo_rastreio = ?", (codigo_rastreio,)).fetchone()
+            _indexar_documento(conn, row["id"])
     return affected > 0
 
 def buscar_documento(codigo_rastreio: str) -> dict | None:
     conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT 
+    row = conn.execute(_SELECT_DOCUMENTOS.format(schema="main") + " WHERE d.codigo_rastreio = ?",
+                       (codigo_rastreio,)).fetchone()
+    if not row:
+        # O código traz a data da impressão: procura no arquivo desse mês e do seguinte
+        # (impresso_em é UTC e pode cair no mês seguinte ao da data local do código)
+        partes = codigo_rastreio.split("-")
+        mes = None
+        if len(partes) >= 2 and len(partes[1]) == 8 and partes[1].isdigit():
+            try:
+                mes = datetime.strptime(partes[1], "%Y%m%d").replace(day=1)
+            except ValueError:
+                pass  # oito dígitos mas não é uma data: não há arquivo a consultar
+        if mes:
+            seguinte = (mes + timedelta(days=32)).strftime("%Y-%m")
+            for arquivo in (_arquivo_do_mes(mes.strftime("%Y-%m")), _arquivo_do_mes(seguinte)):
+                if not arquivo.exists():
+                    continue
+                conn.execute("ATTACH DATABASE ? AS arq", (str(arquivo),))
+                try:
+                    row = conn.execute(_SELECT_DOCUMENTOS.format(schema="arq") + " WHERE d.codigo_rastreio = ?",
+                                       (codigo_rastreio,)).fetchone()
+                finally:
+                    conn.execute("DETACH DATABASE arq")
+                if row:
+                    break
+    conn.close()
+    return dict(row) if row else None
+
+def atualizar_fase_documento(codigo_rastreio: str, fase: str, por_produto: bool = False, usuario_id: int = None) -> int:
+    """
+    Atualiza fase de um documento. Se por_produto=True, aplica a todos do mesmo produto.
+    Na mesma transação grava um evento por destinatário no outbox de notificações.
+    """
+    with transacao() as conn:
+        row = conn.execute("SELECT produto, arquivo, fase FROM documentos_impressos WHERE codigo_rastreio = ?",
+                           (codigo_rastreio,)).fetchone()
+        if not row:
+            return 0
+        produto = row["produto"]
+        if por_produto:
+            cursor = conn.execute("UPDATE documentos_impressos SET fase = ? WHERE produto = ?", (fase, produto))
+        else:
+            cursor = conn.execute("UPDATE documentos_impressos SET fase = ? WHERE codigo_rastreio = ?", (fase, codigo_rastreio))
+        affected = cursor.rowcount
+
+        if affected and DESTINATARIOS_FASE:
+            usuario = conn.execute("SELECT nome FROM usuarios WHERE id = ?", (usuario_id,)).fetchone()
+            dados = {
+                "codigo_rastreio": codigo_rastreio,
+                "arquivo": None if por_produto else row["arquivo"],
+                "fase": fase,
+                "fase_anterior": None if por_produto else row["fase"],
+                "por_produto": por_produto,
+                "documentos": affected,
+                "usuario": usuario["nome"] if usuario else None,
+                "em": _agora(),
+            }
+            _enfileirar_notificacao(conn, "fase", produto, DESTINATARIOS_FASE, dados)
+    return affected
+
+# ============================================
+# OUTBOX DE NOTIFICAÇÕES
+# ============================================
+
+def _agora(delta_s: float = 0) -> str:
+    return (datetime.now() + timedelta(seconds=delta_s)).isoformat(sep=" ", timespec="seconds")
+
+def _enfileirar_notificacao(conn, evento: str, produto: str, destinatarios: list[str], dados: dict):
+    """Grava no outbox usando a conexão (e a transação) de quem chamou"""
+    agora = _agora()
+    conn.executemany("""
+        INSERT INTO notificacoes_outbox (evento, produto, destinatario, dados, criado_em, proxima_tentativa)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, [(evento, produto, d, json.dumps(dados, ensure_ascii=False), agora, agora) for d in destinatarios])
+
+def reservar_notificacoes(limite: int = 500, lease_s: int = 300) -> list[dict]:
+    """
+    Pega as notificações prontas para envio e as marca como 'enviando' por `lease_s`
+    segundos, para que outro worker não envie as mesmas. Se o processo cair no meio,
+    o lease expira e elas voltam para a fila. Cada uma volta com "reserva" (o fim do
+    lease), que identifica esta reserva em renovar_notificacoes.
+    """
+    agora = _agora()
+    reserva = _agora(lease_s)
+    with transacao() as conn:
+        rows = conn.execute("""
+            SELECT * FROM notificacoes_outbox
+            WHERE status IN ('pendente', 'enviando') AND proxima_tentativa <= ?
+            ORDER BY id LIMIT ?
+        """, (agora, limite)).fetchall()
+        if rows:
+            conn.executemany("UPDATE notificacoes_outbox SET status = 'enviando', proxima_tentativa = ? WHERE id = ?",
+                             [(reserva, r["id"]) for r in rows])
+    return [{**dict(r), "dados": json.loads(r["dados"]), "reserva": reserva} for r in rows]
+
+def renovar_notificacoes(ids: list[int], reserva: str, lease_s: int = 300) -> str | None:
+    """
+    Estende o lease antes de enviar. Devolve a nova reserva, ou None se alguma das
+    notificações já não é desta reserva (o lease venceu e outro worker a pegou).
+    """
+    marcadores = ", ".join("?" * len(ids))
+    nova = _agora(lease_s)
+    with transacao() as conn:
+        nossas = conn.execute(f"""
+            SELECT COUNT(*) FROM notificacoes_outbox
+            WHERE id IN ({marcadores}) AND status = 'enviando' AND proxima_tentativa = ?
+        """, (*ids, reserva)).fetchone()[0]
+        if nossas < len(ids):
+            return None
+        conn.execute(f"UPDATE notificacoes_outbox SET proxima_tentativa = ? WHERE id IN ({marcadores})", (nova, *ids))
+    return nova
+
+def marcar_notificacoes_enviadas(ids: list[int]):
+    with transacao() as conn:
+        conn.executemany("UPDATE notificacoes_outbox SET status = 'enviado', enviado_em = ?, erro = NULL WHERE id = ?",
+                         [(_agora(), i) for i in ids])
+
+def adiar_notificacoes(ids: list[int], erro: str, max_tentativas: int, backoff_base_s: int, backoff_max_s: int):
+    """Falha no envio: nova tentativa com backoff exponencial, ou 'falhou' após max_tentativas"""
+    with transacao() as conn:
+        for i in ids:
+            row = conn.execute("SELECT tentativas FROM notificacoes_outbox WHERE id = ?", (i,)).fetchone()
+            tentativas = row["tentativas"] + 1
+            espera = min(backoff_base_s * 2 ** (tentativas - 1), backoff_max_s)
+            conn.execute("""
+                UPDATE notificacoes_outbox
+                SET status = ?, tentativas = ?, proxima_tentativa = ?, erro = ?
+                WHERE id = ?
+            """, ("falhou" if tentativas >= max_tentativas else "pendente", tentativas, _agora(espera), erro, i))
+
+def resumo_outbox() -> dict:
+    conn = get_connection()
+    rows = conn.execute("SELECT status, COUNT(*) as total FROM notificacoes_outbox GROUP BY status").fetchall()
+    conn.close()
+    return {r["status"]: r["total"] for r in rows}
+
+# ============================================
+# BUSCA DE TEXTO NO RASTREIO
+# ============================================
+
+# Acima disso a contagem para e o total é informado como "N+"
+LIMITE_CONTAGEM_BUSCA = 10000
+
+# Pesos bm25 por coluna: codigo_rastreio, produto, arquivo, pasta, usuarios
+_PESOS_BUSCA = "10.0, 5.0, 3.0, 1.0, 2.0"
+
+def _indexar_documento(conn, doc_id: int):
+    """Atualiza a linha do documento no índice de texto (mesma transação da escrita)"""
+    conn.execute("DELETE FROM documentos_fts WHERE rowid = ?", (doc_id,))
+    conn.execute(f"INSERT INTO documentos_fts (rowid, codigo_rastreio, produto, arquivo, pasta, usuarios) "
+                 f"{_SELECT_FTS} WHERE d.id = ?", (doc_id,))
+
+def _consulta_fts(texto: str) -> str | None:
+    """Converte o texto digitado em consulta FTS5: cada palavra vira um prefixo, todas obrigatórias"""
+    termos = re.findall(r"\w+", texto)
+    if not termos:
+        return None
+    return " ".join(f'"{t}"*' for t in termos)
+
+def buscar_documentos_texto(texto: str, pagina: int = 1, por_pagina: int = 50,
+                            status: str = None, fase: str = None) -> dict:
+    """Busca paginada no rastreio por código, produto, arquivo, pasta ou nome de usuário, ordenada por relevância"""
+    consulta = _consulta_fts(texto)
+    if not consulta:
+        return {"documentos": [], "total": 0, "total_limitado": False}
+
+    filtros, params = "", [consulta]
+    if status:
+        filtros += " AND d.status = ?"
+        params.append(status)
+    if fase:
+        filtros += " AND d.fase = ?"
+        params.append(fase)
+
+    conn = get_connection()
+    total = conn.execute(f"""
+        SELECT COUNT(*) FROM (
+            SELECT 1 FROM documentos_fts f JOIN documentos_impressos d ON d.id = f.rowid
+            WHERE documentos_fts MATCH ?{filtros} LIMIT {LIMITE_CONTAGEM_BUSCA + 1}
+        )
+    """, params).fetchone()[0]
+
+    rows = conn.execute(f"""
+        SELECT
             d.*,
             u1.nome as impresso_por_nome,
             u2.nome as recolhido_por_nome,
-            u3.nome as baixado_por_nome
-        FROM documentos_impressos d
+            u3.nome as baixado_por_nome,
+            bm25(documentos_fts, {_PESOS_BUSCA}) as relevancia
+        FROM documentos_fts f
+        JOIN documentos_impressos d ON d.id = f.rowid
         JOIN usuarios u1 ON d.impresso_por_id = u1.id
         LEFT JOIN usuarios u2 ON d.recolhido_por_id = u2.id
         LEFT JOIN usuarios u3 ON d.baixado_por_id = u3.id
-        WHERE d.codigo_rastreio = ?
-    """, (codigo_rastreio,))
-    row = cursor.fetchone()
+        WHERE documentos_fts MATCH ?{filtros}
+        ORDER BY relevancia, d.impresso_em DESC
+        LIMIT ? OFFSET ?
+    """, params + [por_pagina, (pagina - 1) * por_pagina]).fetchall()
     conn.close()
-    return dict(row) if row else None
 
-def atualizar_fase_documento(codigo_rastreio: str, fase: str, por_produto: bool = False) -> int:
-    """Atualiza fase de um documento. Se por_produto=True, aplica a todos do mesmo produto."""
+    return {
+        "documentos": [dict(r) for r in rows],
+        "total": min(total, LIMITE_CONTAGEM_BUSCA),
+        "total_limitado": total > LIMITE_CONTAGEM_BUSCA,
+    }
+
+# ============================================
+# RETENÇÃO E ARQUIVAMENTO
+# ============================================
+
+def _arquivo_do_mes(mes: str) -> Path:
+    """Caminho do arquivo mensal; mes no formato AAAA-MM"""
+    return ARQUIVO_DIR / f"fastprint-{mes}.db"
+
+def _arquivos_no_intervalo(desde: str, ate: str = None) -> list[Path]:
+    inicio, fim = desde[:7], (ate or "9999-12")[:7]
+    arquivos = []
+    for arquivo in sorted(ARQUIVO_DIR.glob("fastprint-????-??.db")):
+        mes = arquivo.stem[len("fastprint-"):]
+        if inicio <= mes <= fim:
+            arquivos.append(arquivo)
+    return arquivos
+
+def _filtro_periodo(coluna: str, desde: str = None, ate: str = None) -> tuple[str, list]:
+    """WHERE para [desde, ate] inclusivo (datas AAAA-MM-DD)"""
+    filtros, params = [], []
+    if desde:
+        filtros.append(f"{coluna} >= ?")
+        params.append(desde)
+    if ate:
+        filtros.append(f"{coluna} < ?")
+        params.append((datetime.strptime(ate[:10], "%Y-%m-%d") + timedelta(days=1)).strftime("%Y-%m-%d"))
+    return (" WHERE " + " AND ".join(filtros) if filtros else ""), params
+
+def _consultar_com_arquivos(select: str, resto: str, params: list, chave: str,
+                            limite: int | None, desde: str = None, ate: str = None) -> list[dict]:
+    """
+    Executa a consulta no banco principal e, se houver período (`desde`), repete em cada
+    arquivo mensal anexado, juntando tudo por `chave` decrescente.
+    """
+    params = params + [-1 if limite is None else limite]
     conn = get_connection()
-    cursor = conn.cursor()
+    rows = [dict(r) for r in conn.execute(select.format(schema="main") + resto, params)]
 
-    if por_produto:
-        cursor.execute("SELECT produto FROM documentos_impressos WHERE codigo_rastreio = ?", (codigo_rastreio,))
-        row = cursor.fetchone()
-        if not row:
-            conn.close()
-            return 0
-        produto = row["produto"]
-        cursor.execute("UPDATE documentos_impressos SET fase = ? WHERE produto = ?", (fase, produto))
-    else:
-        cursor.execute("UPDATE documentos_impressos SET fase = ? WHERE codigo_rastreio = ?", (fase, codigo_rastreio))
+    if desde:
+        for arquivo in _arquivos_no_intervalo(desde, ate):
+            conn.execute("ATTACH DATABASE ? AS arq", (str(arquivo),))
+            try:
+                rows += [dict(r) for r in conn.execute(select.format(schema="arq") + resto, params)]
+            finally:
+                conn.execute("DETACH DATABASE arq")
+        rows.sort(key=lambda r: r[chave] or "", reverse=True)
+        if limite is not None:
+            rows = rows[:limite]
 
-    affected = cursor.rowcount
-    conn.commit()
     conn.close()
-    return affected
+    return rows
+
+def _preparar_arquivo(conn):
+    """Cria/atualiza as tabelas do arquivo anexado (arq) com as colunas atuais do banco principal"""
+    for tabela in ("documentos_impressos", "logs"):
+        existe = conn.execute("SELECT 1 FROM arq.sqlite_master WHERE type = 'table' AND name = ?", (tabela,)).fetchone()
+        if not existe:
+            conn.execute(f"CREATE TABLE arq.{tabela} AS SELECT * FROM main.{tabela} WHERE 0")
+            continue
+        colunas_arq = {r["name"] for r in conn.execute(f"PRAGMA arq.table_info({tabela})")}
+        for col in conn.execute(f"PRAGMA main.table_info({tabela})").fetchall():
+            if col["name"] not in colunas_arq:
+                conn.execute(f"ALTER TABLE arq.{tabela} ADD COLUMN {col['name']} {col['type']}")
+    # id único no arquivo: a transação com ATTACH não é atômica entre os arquivos em WAL, então
+    # uma queda entre os commits deixa a linha nos dois bancos e a próxima rodada a move de novo
+    for tabela, indice in (("documentos_impressos", "idx_arq_docs_id"), ("logs", "idx_arq_logs_id")):
+        existe = conn.execute("SELECT 1 FROM arq.sqlite_master WHERE type = 'index' AND name = ?", (indice,)).fetchone()
+        if not existe:
+            # Arquivos de antes do índice podem ter linhas repetidas de uma rodada interrompida
+            conn.execute(f"DELETE FROM arq.{tabela} WHERE rowid NOT IN (SELECT MIN(rowid) FROM arq.{tabela} GROUP BY id)")
+            conn.execute(f"CREATE UNIQUE INDEX arq.{indice} ON {tabela}(id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS arq.idx_arq_docs_codigo ON documentos_impressos(codigo_rastreio)")
+    conn.execute("CREATE INDEX IF NOT EXISTS arq.idx_arq_docs_impresso_em ON documentos_impressos(impresso_em)")
+    conn.execute("CREATE INDEX IF NOT EXISTS arq.idx_arq_logs_data ON logs(data)")
+
+def _mover_para_arquivo(conn, tabela: str, filtro: str, params: tuple) -> int:
+    if tabela == "documentos_impressos":
+        # A busca de texto cobre só o banco principal
+        conn.execute(f"DELETE FROM main.documentos_fts WHERE rowid IN (SELECT id FROM main.{tabela} WHERE {filtro})", params)
+    colunas = ", ".join(r["name"] for r in conn.execute(f"PRAGMA main.table_info({tabela})"))
+    # OR IGNORE: a linha pode já estar no arquivo (rodada anterior interrompida entre os commits)
+    conn.execute(f"INSERT OR IGNORE INTO arq.{tabela} ({colunas}) SELECT {colunas} FROM main.{tabela} WHERE {filtro}", params)
+    return conn.execute(f"DELETE FROM main.{tabela} WHERE {filtro}", params).rowcount
+
+def arquivar_antigos(dias: int = RETENCAO_DIAS, compactar: bool = True) -> dict:
+    """
+    Move documentos baixados há mais de `dias` dias e logs mais antigos que isso para
+    arquivos mensais (pelo mês de impressão / do log). Cada mês é movido numa transação.
+    """
+    corte = datetime.now() - timedelta(days=dias)
+    corte_baixa = corte.isoformat()                            # baixado_em: datetime.now().isoformat()
+    corte_log = corte.isoformat(sep=" ", timespec="seconds")   # data: CURRENT_TIMESTAMP
+
+    filtro_docs = "status = 'baixado' AND baixado_em < ? AND substr(impresso_em, 1, 7) = ?"
+    filtro_logs = "data < ? AND substr(data, 1, 7) = ?"
+
+    conn = get_connection()
+    conn.isolation_level = None
+    meses = {r[0] for r in conn.execute(
+        "SELECT DISTINCT substr(impresso_em, 1, 7) FROM documentos_impressos WHERE status = 'baixado' AND baixado_em < ?",
+        (corte_baixa,))}
+    meses |= {r[0] for r in conn.execute("SELECT DISTINCT substr(data, 1, 7) FROM logs WHERE data < ?", (corte_log,))}
+
+    resultado = {"documentos": 0, "logs": 0, "arquivos": []}
+    if meses:
+        ARQUIVO_DIR.mkdir(parents=True, exist_ok=True)
+
+    for mes in sorted(meses):
+        arquivo = _arquivo_do_mes(mes)
+        conn.execute("ATTACH DATABASE ? AS arq", (str(arquivo),))
+        try:
+            _preparar_arquivo(conn)
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                resultado["documentos"] += _mover_para_arquivo(conn, "documentos_impressos", filtro_docs, (corte_baixa, mes))
+                resultado["logs"] += _mover_para_arquivo(conn, "logs", filtro_logs, (corte_log, mes))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            conn.execute("DETACH DATABASE arq")
+        resultado["arquivos"].append(arquivo.name)
+
+    # Devolve ao disco o espaço liberado, mantendo o banco principal pequeno
+    if compactar and (resultado["documentos"] or resultado["logs"]):
+        conn.execute("VACUUM")
+    conn.close()
+    return resultado
+
+# ============================================
+# CACHE ENTRE WORKERS
+# ============================================
+
+def versao_cache(namespace: str) -> int:
+    conn = get_connection()
+    row = conn.execute("SELECT versao FROM cache_versao WHERE namespace = ?", (namespace,)).fetchone()
+    conn.close()
+    return row["versao"] if row else 0
 
-# Inicializa o banco quando o módulo é importado
-init_db()
\ No newline at end of file
+def incrementar_versao_cache(namespace: str) -> int:
+    """Invalida o namespace em todos os processos que compartilham este banco"""
+    with transacao() as conn:
+        row = conn.execute("""
+            INSERT INTO cache_versao (namespace, versao) VALUES (?, 1)
+            ON CONFLICT(namespace) DO UPDATE SET versao = versao + 1
+            RETURNING versao
+        """, (namespace,)).fetchone()
+    return row["versao"]
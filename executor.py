@@ -0,0 +1,185 @@
+"""
+Camada de execução
+Pools de threads limitados para I/O no compartilhamento de rede e acesso ao banco,
+para que as rotas async não bloqueiem o event loop.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+
+class PoolSaturado(Exception):
+    """Pool sem capacidade: todas as threads ocupadas e fila de espera cheia."""
+
+    def __init__(self, nome: str):
+        super().__init__(f"Servidor ocupado ({nome}). Tente novamente em instantes.")
+        self.nome = nome
+
+
+class BoundedPool:
+    """
+    ThreadPoolExecutor com limite de tarefas em espera.
+    Aceita até max_workers em execução + max_fila aguardando; acima disso levanta PoolSaturado.
+    Com max_fila=None não recusa: quem chama já controla a admissão (ex.: fila de impressão).
+    """
+
+    def __init__(self, nome: str, max_workers: int, max_fila: int | None):
+        self.nome = nome
+        self.max_workers = max_workers
+        self.max_fila = max_fila
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"fp-{nome}")
+        self._lock = threading.Lock()
+        self._em_uso = 0
+        self.rejeitadas = 0
+
+    @property
+    def capacidade(self) -> int | None:
+        return None if self.max_fila is None else self.max_workers + self.max_fila
+
+    def _admitir(self):
+        with self._lock:
+            if self.capacidade is not None and self._em_uso >= self.capacidade:
+                self.rejeitadas += 1
+                raise PoolSaturado(self.nome)
+            self._em_uso += 1
+
+    def _liberar(self):
+        with self._lock:
+            self._em_uso -= 1
+
+    async def run(self, fn, *args, **kwargs):
+        """Executa fn(*args, **kwargs) numa thread do pool e aguarda o resultado."""
+        self._admitir()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, partial(fn, *args, **kwargs))
+        finally:
+            self._liberar()
+
+    def stream(self, gen_fn, *args, max_buffer: int = 256, max_ocioso_s: float = 60, **kwargs):
+        """
+        Consome o gerador síncrono gen_fn(*args) numa única thread do pool e
+        devolve um gerador async com os itens. A admissão acontece aqui, antes
+        de começar a resposta, para que a saturação ainda vire um 503.
+
+        No máximo max_buffer itens ficam esperando o cliente: acima disso a thread
+        espera. Se o consumidor for fechado (cliente desconectou), a thread para
+        de percorrer e libera a vaga. Se o buffer ficar cheio sem ninguém ler por
+        max_ocioso_s (ex.: a resposta nunca começou a ser enviada), a thread também para.
+        """
+        self._admitir()
+        loop = asyncio.get_running_loop()
+        fila: asyncio.Queue = asyncio.Queue()
+        vagas = threading.Semaphore(max_buffer)
+        parar = threading.Event()
+        fim = object()
+        ultima_leitura = time.monotonic()
+
+        def entregar(item, erro=None) -> bool:
+            # Espera vaga no buffer sem ficar presa se o consumidor já foi embora (ou nunca veio)
+            while not vagas.acquire(timeout=0.5):
+                if parar.is_set():
+                    return False
+                if time.monotonic() - ultima_leitura > max_ocioso_s:
+                    parar.set()
+                    return False
+            if parar.is_set():
+                return False
+            loop.call_soon_threadsafe(fila.put_nowait, (item, erro))
+            return True
+
+        def produzir():
+            gen = gen_fn(*args, **kwargs)
+            try:
+                for item in gen:
+                    if not entregar(item):
+                        return
+            except Exception as e:
+                entregar(fim, e)
+            else:
+                entregar(fim)
+            finally:
+                gen.close()
+
+        try:
+            futuro = self._executor.submit(produzir)
+        except Exception:
+            self._liberar()
+            raise
+        futuro.add_done_callback(lambda _: self._liberar())
+
+        async def consumir():
+            nonlocal ultima_leitura
+            try:
+                while True:
+                    item, erro = await fila.get()
+                    ultima_leitura = time.monotonic()
+                    vagas.release()
+                    if erro is not None:
+                        raise erro
+                    if item is fim:
+                        return
+                    yield item
+            finally:
+                # Fechado antes do fim (aclose, cancelamento ou desconexão): avisa a thread
+                parar.set()
+
+        return consumir()
+
+    def status(self) -> dict:
+        with self._lock:
+            em_uso = self._em_uso
+        return {
+            "nome": self.nome,
+            "workers": self.max_workers,
+            "fila_max": self.max_fila,
+            "em_uso": em_uso,
+            "rejeitadas": self.rejeitadas,
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+# ============================================
+# POOLS
+# ============================================
+
+# I/O no compartilhamento (L:\) é lento e sensível à latência da rede: mais threads
+share_pool = BoundedPool(
+    "compartilhamento",
+    max_workers=int(os.environ.get("FASTPRINT_SHARE_WORKERS", 8)),
+    max_fila=int(os.environ.get("FASTPRINT_SHARE_FILA", 32)),
+)
+
+# SQLite serializa escritas; poucas threads bastam
+db_pool = BoundedPool(
+    "banco",
+    max_workers=int(os.environ.get("FASTPRINT_DB_WORKERS", 4)),
+    max_fila=int(os.environ.get("FASTPRINT_DB_FILA", 64)),
+)
+
+
+# Carimbo + envio ao spooler. A fila de impressão (scheduler.py) já limitou o que entra,
+# então um arquivo aceito espera thread aqui em vez de falhar com 503
+print_pool = BoundedPool(
+    "impressao",
+    max_workers=int(os.environ.get("FASTPRINT_PRINT_WORKERS", 4)),
+    max_fila=None,
+)
+
+
+async def run_share(fn, *args, **kwargs):
+    return await share_pool.run(fn, *args, **kwargs)
+
+
+async def run_db(fn, *args, **kwargs):
+    return await db_pool.run(fn, *args, **kwargs)
+
+
+async def run_print(fn, *args, **kwargs):
+    return await print_pool.run(fn, *args, **kwargs)
@@ -0,0 +1,151 @@
+"""
+Regras de filtro de pastas e PDFs
+As regras ficam em filtros.json e são compiladas numa única regex por lista.
+O arquivo é relido quando muda, sem reiniciar o servidor.
+
+Formato de cada termo:
+    "REVISAO"          → trecho em qualquer parte do nome (sem diferenciar maiúsculas)
+    "glob:*- V?.pdf"   → padrão glob sobre o nome inteiro
+
+Um nome é ignorado quando casa com "excluir" e não casa com "incluir"
+("incluir" funciona como exceção às exclusões).
+"""
+
+import fnmatch
+import json
+import os
+import re
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+FILTROS_PATH = Path(os.environ.get("FASTPRINT_FILTROS") or Path(__file__).parent / "filtros.json")
+
+# Intervalo mínimo (s) entre verificações de mudança no arquivo
+CHECAGEM_S = 2.0
+
+
+def _compilar(termos: list[str]) -> re.Pattern | None:
+    partes = []
+    for termo in termos:
+        if termo.startswith("glob:"):
+            partes.append("^" + fnmatch.translate(termo[len("glob:"):]))
+        else:
+            partes.append(re.escape(termo))
+    if not partes:
+        return None
+    return re.compile("|".join(f"(?:{p})" for p in partes), re.IGNORECASE)
+
+
+class Regra:
+    """Par excluir/incluir compilado"""
+
+    def __init__(self, excluir: list[str], incluir: list[str]):
+        self.excluir = list(excluir)
+        self.incluir = list(incluir)
+        self._excluir = _compilar(self.excluir)
+        self._incluir = _compilar(self.incluir)
+
+    def ignora(self, nome: str) -> bool:
+        if self._excluir is None or not self._excluir.search(nome):
+            return False
+        return self._incluir is None or not self._incluir.search(nome)
+
+    def como_dict(self) -> dict:
+        return {"excluir": self.excluir, "incluir": self.incluir}
+
+
+class FilterRules:
+    """Regras de pastas e de PDFs carregadas de um arquivo"""
+
+    def __init__(self, pastas: Regra, pdfs: Regra):
+        self.pastas = pastas
+        self.pdfs = pdfs
+
+    @classmethod
+    def from_dict(cls, dados: dict) -> "FilterRules":
+        """Levanta ValueError se o formato não for {"pastas"|"pdfs": {"excluir"|"incluir": [textos]}}"""
+        if not isinstance(dados, dict):
+            raise ValueError("o arquivo deve conter um objeto JSON")
+        desconhecidas = set(dados) - {"pastas", "pdfs"}
+        if desconhecidas:
+            raise ValueError(f"seções desconhecidas: {', '.join(sorted(desconhecidas))}")
+
+        def termos(chave: str, secao: dict, lista: str) -> list[str]:
+            valor = secao.get(lista, [])
+            # Uma string solta viraria um termo por caractere: "V0" ignoraria todo nome com V ou 0
+            if not isinstance(valor, list) or not all(isinstance(t, str) and t for t in valor):
+                raise ValueError(f"'{chave}.{lista}' deve ser uma lista de textos não vazios")
+            return valor
+
+        def regra(chave: str) -> Regra:
+            secao = dados.get(chave)
+            if secao is None:
+                secao = {}
+            if not isinstance(secao, dict):
+                raise ValueError(f"'{chave}' deve ser um objeto com 'excluir' e 'incluir'")
+            desconhecidas = set(secao) - {"excluir", "incluir"}
+            if desconhecidas:
+                raise ValueError(f"chaves desconhecidas em '{chave}': {', '.join(sorted(desconhecidas))}")
+            return Regra(termos(chave, secao, "excluir"), termos(chave, secao, "incluir"))
+
+        return cls(regra("pastas"), regra("pdfs"))
+
+    def ignore_folder(self, name: str) -> bool:
+        return self.pastas.ignora(name)
+
+    def ignore_pdf(self, name: str) -> bool:
+        return self.pdfs.ignora(name)
+
+    def como_dict(self) -> dict:
+        return {"pastas": self.pastas.como_dict(), "pdfs": self.pdfs.como_dict()}
+
+
+class RulesFile:
+    """
+    Mantém as regras do arquivo em memória e recarrega quando o mtime muda.
+    `ao_mudar` é chamado depois de cada recarga (ex.: invalidar caches de varredura).
+    Se o arquivo novo estiver inválido, as regras anteriores continuam valendo.
+    """
+
+    def __init__(self, path: Path, ao_mudar=None):
+        self.path = path
+        self.ao_mudar = ao_mudar
+        self._lock = threading.Lock()
+        self._regras = FilterRules(Regra([], []), Regra([], []))
+        self._mtime = None
+        self._ultima_checagem = 0.0
+        self.carregado_em = None
+        self._recarregar()
+
+    def _recarregar(self) -> bool:
+        try:
+            mtime = self.path.stat().st_mtime
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self._mtime:
+            return False
+        try:
+            dados = json.loads(self.path.read_text(encoding="utf-8")) if mtime is not None else {}
+            regras = FilterRules.from_dict(dados)
+        except (OSError, ValueError, re.error) as e:
+            print(f"Erro ao carregar {self.path.name}, mantendo regras anteriores: {e}")
+            self._mtime = mtime
+            return False
+        if mtime is None:
+            print(f"AVISO: {self.path} não encontrado. Nenhuma pasta ou PDF será ignorado.")
+        self._regras = regras
+        self._mtime = mtime
+        self.carregado_em = datetime.now().isoformat(timespec="seconds")
+        return True
+
+    def current(self) -> FilterRules:
+        agora = time.monotonic()
+        if agora - self._ultima_checagem >= CHECAGEM_S:
+            with self._lock:
+                if agora - self._ultima_checagem >= CHECAGEM_S:
+                    self._ultima_checagem = agora
+                    if self._recarregar() and self.ao_mudar:
+                        self.ao_mudar()
+        return self._regras
@@ -3,9 +3,8 @@ Sistema de Impressão em Lote - Linea Brasil
 Fase 1: Script local com interface web
 """
 
-from fastapi import FastAPI, HTTPException, Header
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse, FileResponse
+from fastapi import FastAPI, HTTPException, Header, Request
+from fastapi.responses import HTMLResponse, StreamingResponse, JSONResponse, Response
 from pydantic import BaseModel
 from pathlib import Path
 import subprocess
@@ -13,29 +12,95 @@ import platform
 import os
 import socket
 import tempfile
+import json
+import asyncio
+from functools import partial
+import csv
+import hashlib
+import heapq
+import io
 from typing import Optional
 from datetime import datetime, timedelta
+from contextlib import asynccontextmanager
 import jwt
 from database import (
-    verificar_login, registrar_log, criar_usuario, listar_usuarios, listar_logs,
-    gerar_codigo_rastreio, registrar_documento_impresso,
+    init_db, verificar_login, registrar_log, criar_usuario, listar_usuarios, listar_logs,
+    reservar_codigos_rastreio, registrar_documento_impresso,
     listar_documentos, atualizar_status_documento, buscar_documento,
-    atualizar_fase_documento
+    atualizar_fase_documento, arquivar_antigos, RETENCAO_DIAS, buscar_documentos_texto,
+    resumo_outbox, DESTINATARIOS_FASE, ultimas_assinaturas
 )
+from executor import PoolSaturado, share_pool, db_pool, print_pool, run_share, run_db, run_print
+from cache import printers_cache, scan_cache, catalog_cache
+from filtros import RulesFile, FILTROS_PATH
+from warmup import warmup, aquecer_pdf, pdf_disponivel
+from assets import CachedStaticFiles, index_response, manifest
+from compression import CompressionMiddleware
+from scheduler import FilaCheia, criar_scheduler
+from notificacoes import outbox_sender
+from busca import BuscaRaizes, PARALELO_RAIZ
 
 # ============================================
-# FILTROS - AJUSTE CONFORME NECESSÁRIO
+# FILTROS - AJUSTE EM filtros.json (recarregado automaticamente)
 # ============================================
 
-IGNORAR_PDFS = ["ENG - 011 - 510000000 - NOME PEÇA - P1-1 - V0",
-                "ENG - 011 - 510000000 - NOME PEÇA - P1-1 - V1",
-                "ENG - 011 - 510000000 - NOME PEÇA - P1-1 - V2"]
-
-IGNORAR_PASTAS = ["- 003 -", "003 - MONTAGEM", "REVISAO", "REVISÃO"]
+# Uma mudança nas regras altera o resultado de qualquer varredura em cache
+filter_rules = RulesFile(FILTROS_PATH, ao_mudar=scan_cache.invalidate)
 
 SECRET_KEY = "fastprint-linea-2025-sua-chave-secreta"
 
-app = FastAPI(title="FastPrint - Linea Brasil")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Migrações pendentes (com o schema em dia, só lê PRAGMA user_version)
+    await run_db(init_db)
+
+    # O servidor já atende enquanto o aquecimento roda em segundo plano.
+    # Sem pypdf/reportlab não há o que aquecer para o carimbo: a etapa nem entra
+    etapas = [("pdf", aquecer_pdf)] if pdf_disponivel() else []
+    etapas += [
+        ("estaticos", manifest.aquecer),
+        ("impressoras", get_available_printers),
+        ("catalogo", preload_catalog),
+    ]
+    tarefa = asyncio.create_task(warmup.executar(etapas, run_share))
+
+    # E-mails de mudança de fase (outbox), só com SMTP configurado
+    envio = asyncio.create_task(outbox_sender.executar()) if outbox_sender.host else None
+    if DESTINATARIOS_FASE and not outbox_sender.host:
+        print("AVISO: FASTPRINT_NOTIFICAR_FASE definido sem FASTPRINT_SMTP_HOST; notificações ficam no outbox.")
+    yield
+    tarefa.cancel()
+    if envio:
+        envio.cancel()
+    await print_scheduler.shutdown()
+    share_pool.shutdown()
+    db_pool.shutdown()
+    print_pool.shutdown()
+
+
+app = FastAPI(title="FastPrint - Linea Brasil", lifespan=lifespan)
+
+# Fila justa por impressora na frente do caminho de impressão
+print_scheduler = criar_scheduler()
+
+# Busca de produtos em todas as raízes ao mesmo tempo, com prazo por raiz
+busca_raizes = BuscaRaizes()
+
+# JSON e estáticos acima de 1 KB saem comprimidos (br se disponível, senão gzip)
+app.add_middleware(CompressionMiddleware, minimum_size=1024)
+
+
+@app.exception_handler(PoolSaturado)
+async def pool_saturado_handler(request: Request, exc: PoolSaturado):
+    """Pool de threads cheio: devolve 503 em vez de enfileirar sem limite"""
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "2"})
+
+
+@app.exception_handler(FilaCheia)
+async def fila_cheia_handler(request: Request, exc: FilaCheia):
+    """Backpressure do escalonador de impressão"""
+    return JSONResponse(status_code=429, content={"detail": str(exc), "retry_after": exc.retry_after},
+                        headers={"Retry-After": str(exc.retry_after)})
 
 # ============================================
 # CONFIGURAÇÕES
@@ -48,6 +113,13 @@ SEARCH_PATHS = [
 
 DEFAULT_PRINTER: Optional[str] = None
 
+# Identifica este host no código de rastreio (FP-AAAAMMDD-SEQ-NO), só com os caracteres
+# alfanuméricos. Em vários hosts, defina um ID curto e distinto em cada um.
+NODE_ID = os.environ.get("FASTPRINT_NODE_ID") or socket.gethostname()
+
+# Número de processos uvicorn (python main.py)
+WORKERS = int(os.environ.get("FASTPRINT_WORKERS", 1))
+
 # ============================================
 # MODELS
 # ============================================
@@ -57,6 +129,8 @@ class PrintRequest(BaseModel):
     printer: Optional[str] = None
     selected_files: Optional[list[str]] = None
     fase: Optional[str] = None  # "Lote Teste", "Lote Piloto", "Lote Padrão"
+    urgente: bool = False       # passa à frente das impressões normais na fila da impressora
+    apenas_alterados: bool = False  # pula PDFs iguais aos da última impressão do produto
 
 class FolderRequest(BaseModel):
     path: str
@@ -91,6 +165,14 @@ def get_hostname() -> str:
         return "DESCONHECIDO"
 
 def get_available_printers() -> list[str]:
+    cached = printers_cache.get("todas")
+    if cached is not None:
+        return cached
+    printers = _discover_printers()
+    printers_cache.set("todas", printers)
+    return printers
+
+def _discover_printers() -> list[str]:
     system = platform.system()
 
     if system == "Windows":
@@ -107,27 +189,25 @@ def get_available_printers() -> list[str]:
     return ["Impressora Padrão"]
 
 
-def find_pdf_files(folder_path: str) -> list[dict]:
+def iter_pdf_files(folder_path: str):
+    """
+    Percorre as pastas ENG do produto e produz cada PDF assim que é encontrado.
+    A ordem é a da listagem do sistema de arquivos; use find_pdf_files para a lista ordenada.
+    """
     path = Path(folder_path)
 
     if not path.exists():
         raise FileNotFoundError(f"Pasta não encontrada: {folder_path}")
 
-    pdf_files = []
-
     def is_eng_folder(name: str) -> bool:
         upper_name = name.upper()
         return (upper_name.startswith("ENG -") or
                 upper_name.startswith("ENG-") or
                 upper_name == "ENG")
 
-    def should_ignore_folder(name: str) -> bool:
-        upper_name = name.upper()
-        return any(termo in upper_name for termo in IGNORAR_PASTAS)
-
-    def should_ignore_pdf(name: str) -> bool:
-        upper_name = name.upper()
-        return any(termo in upper_name for termo in IGNORAR_PDFS)
+    regras = filter_rules.current()
+    should_ignore_folder = regras.ignore_folder
+    should_ignore_pdf = regras.ignore_pdf
 
     def scan_folder(folder: Path, parent_name: str = ""):
         for item in folder.iterdir():
@@ -135,31 +215,114 @@ def find_pdf_files(folder_path: str) -> list[dict]:
                 if should_ignore_pdf(item.name):
                     continue
                 display_folder = parent_name or folder.name
-                pdf_files.append({
+                yield {
                     "name": item.name,
                     "path": str(item),
                     "folder": display_folder,
                     "size_kb": round(item.stat().st_size / 1024, 1)
-                })
+                }
             elif item.is_dir() and not should_ignore_folder(item.name):
-                scan_folder(item, parent_name or folder.name)
+                yield from scan_folder(item, parent_name or folder.name)
 
     for subdir in path.iterdir():
         if subdir.is_dir() and is_eng_folder(subdir.name) and not should_ignore_folder(subdir.name):
-            scan_folder(subdir)
+            yield from scan_folder(subdir)
 
     if is_eng_folder(path.name):
         for item in path.iterdir():
             if item.is_file() and item.suffix.lower() == ".pdf":
                 if not should_ignore_pdf(item.name):
-                    pdf_files.append({
+                    yield {
                         "name": item.name,
                         "path": str(item),
                         "folder": path.name,
                         "size_kb": round(item.stat().st_size / 1024, 1)
-                    })
+                    }
+
 
-    return sorted(pdf_files, key=lambda x: (x["folder"], x["name"]))
+def find_pdf_files(folder_path: str) -> list[dict]:
+    filter_rules.current()  # recarrega as regras (e invalida o cache) antes de consultar o cache
+    cached = scan_cache.get(folder_path)
+    if cached is not None:
+        return cached
+    pdf_files = sorted(iter_pdf_files(folder_path), key=lambda x: (x["folder"], x["name"]))
+    scan_cache.set(folder_path, pdf_files)
+    return pdf_files
+
+
+def stream_pdf_files(folder_path: str):
+    """Gera linhas NDJSON: um registro "file" por PDF e um "summary" final."""
+    filter_rules.current()
+    cached = scan_cache.get(folder_path)
+    encontrados = []
+    try:
+        for pdf in (cached if cached is not None else iter_pdf_files(folder_path)):
+            encontrados.append(pdf)
+            yield json.dumps({"type": "file", **pdf}, ensure_ascii=False) + "\n"
+    except Exception as e:
+        # O status HTTP já foi enviado; o erro segue como registro do próprio stream
+        yield json.dumps({"type": "error", "detail": str(e)}, ensure_ascii=False) + "\n"
+        return
+    if cached is None:
+        scan_cache.set(folder_path, sorted(encontrados, key=lambda x: (x["folder"], x["name"])))
+    yield json.dumps({"type": "summary", "folder": folder_path, "total": len(encontrados)}, ensure_ascii=False) + "\n"
+
+
+def assinatura_pdf(pdf_path: str, com_hash: bool = True) -> dict:
+    """Tamanho, mtime e (opcional) SHA-256 do conteúdo de um PDF"""
+    st = os.stat(pdf_path)
+    assinatura = {"tamanho": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": None}
+    if com_hash:
+        h = hashlib.sha256()
+        with open(pdf_path, "rb") as f:
+            for bloco in iter(lambda: f.read(1024 * 1024), b""):
+                h.update(bloco)
+        assinatura["sha256"] = h.hexdigest()
+    return assinatura
+
+
+def caminho_relativo(pdf_path: str, folder_path: str) -> str:
+    """Caminho do PDF dentro da pasta do produto, com "/" (chave da última impressão do arquivo)"""
+    try:
+        return Path(pdf_path).relative_to(folder_path).as_posix()
+    except ValueError:
+        return Path(pdf_path).as_posix()  # selecionado fora da pasta do produto: o caminho inteiro
+
+
+def separar_alterados(pdfs: list[dict], anteriores: dict[str, dict]) -> tuple[list[dict], list[dict]]:
+    """
+    Divide os PDFs em (a imprimir, inalterados) comparando com a última impressão de cada um,
+    pelo caminho relativo (pdf["relativo"]): o mesmo nome pode estar em duas pastas ENG.
+    O hash só é calculado quando tamanho e mtime não decidem: mesmo tamanho com mtime
+    diferente (arquivo copiado ou salvo de novo sem mudança). O hash calculado aqui vai
+    junto no PDF para não ler o arquivo duas vezes.
+    """
+    imprimir, inalterados = [], []
+    for pdf in pdfs:
+        anterior = anteriores.get(pdf["relativo"])
+        if not anterior or not anterior["arquivo_sha256"]:
+            imprimir.append(pdf)  # nunca impresso, ou impresso antes de gravar a assinatura
+            continue
+        try:
+            atual = assinatura_pdf(pdf["path"], com_hash=False)
+        except OSError:
+            imprimir.append(pdf)  # a impressão relata o erro
+            continue
+        if atual["tamanho"] != anterior["arquivo_tamanho"]:
+            imprimir.append(pdf)
+            continue
+        if atual["mtime_ns"] != anterior["arquivo_mtime_ns"]:
+            atual = assinatura_pdf(pdf["path"])
+            if atual["sha256"] != anterior["arquivo_sha256"]:
+                imprimir.append({**pdf, "assinatura": atual})
+                continue
+        inalterados.append({
+            "file": pdf["name"],
+            "path": pdf["path"],
+            "codigo_rastreio_anterior": anterior["codigo_rastreio"],
+            "impresso_em": anterior["impresso_em"],
+        })
+    return imprimir, inalterados
 
 
 def stamp_pdf(pdf_path: str, codigo_rastreio: str, fase: str = None) -> str | None:
@@ -337,7 +500,7 @@ def print_pdf(pdf_path: str, printer: Optional[str] = None) -> dict:
 
 @app.post("/api/login")
 async def login(request: LoginRequest):
-    user = verificar_login(request.usuario, request.senha)
+    user = await run_db(verificar_login, request.usuario, request.senha)
     if not user:
         raise HTTPException(status_code=401, detail="Usuário ou senha inválidos")
 
@@ -360,26 +523,82 @@ async def verificar_token(token: str):
 
 @app.post("/api/usuarios")
 async def criar_novo_usuario(request: NovoUsuarioRequest):
-    if criar_usuario(request.nome, request.usuario, request.senha):
+    if await run_db(criar_usuario, request.nome, request.usuario, request.senha):
         return {"success": True, "message": f"Usuário {request.usuario} criado"}
     raise HTTPException(status_code=400, detail="Usuário já existe")
 
 @app.get("/api/usuarios")
 async def get_usuarios():
-    return {"usuarios": listar_usuarios()}
+    return {"usuarios": await run_db(listar_usuarios)}
+
+def _validar_periodo(desde: str = None, ate: str = None):
+    """400 se desde/ate não forem datas AAAA-MM-DD"""
+    for nome, valor in (("desde", desde), ("ate", ate)):
+        if valor is None:
+            continue
+        try:
+            datetime.strptime(valor[:10], "%Y-%m-%d")
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Data inválida em '{nome}': use AAAA-MM-DD")
 
 @app.get("/api/logs")
-async def get_logs(limite: int = 100):
-    return {"logs": listar_logs(limite)}
+async def get_logs(limite: int = 100, desde: str = None, ate: str = None):
+    _validar_periodo(desde, ate)
+    return {"logs": await run_db(listar_logs, limite, desde=desde, ate=ate)}
+
+@app.post("/api/admin/arquivar")
+async def archive_old_records(dias: int = RETENCAO_DIAS, compactar: bool = False,
+                              authorization: str = Header(default=None)):
+    """
+    Move documentos baixados e logs antigos para os arquivos mensais.
+    compactar=true roda VACUUM no fim, que segura as escritas enquanto dura: use fora do expediente.
+    """
+    if not _get_user_id(authorization):
+        raise HTTPException(status_code=401, detail="Não autorizado")
+    if dias < 1:
+        raise HTTPException(status_code=400, detail="dias deve ser pelo menos 1")
+    return {"success": True, **await run_db(arquivar_antigos, dias, compactar)}
 
 # --- RASTREIO ---
 
 @app.get("/api/documentos")
-async def get_documentos(status: str = None, limite: int = 200):
-    """Lista documentos impressos com filtro opcional de status"""
-    docs = listar_documentos(status=status, limite=limite)
+async def get_documentos(status: str = None, limite: int = 200, desde: str = None, ate: str = None):
+    """Lista documentos impressos com filtro opcional de status e período (AAAA-MM-DD)"""
+    _validar_periodo(desde, ate)
+    docs = await run_db(listar_documentos, status=status, limite=limite, desde=desde, ate=ate)
     return {"documentos": docs, "total": len(docs)}
 
+COLUNAS_EXPORTACAO = [
+    "codigo_rastreio", "produto", "arquivo", "pasta", "fase", "status", "impressora", "computador",
+    "impresso_por_nome", "impresso_em", "baixado_por_nome", "baixado_em",
+]
+
+def _exportar_csv(desde: str, ate: str, status: str = None) -> str:
+    docs = listar_documentos(status=status, limite=None, desde=desde, ate=ate)
+    buffer = io.StringIO()
+    # ";" e BOM para abrir direto no Excel em português
+    writer = csv.DictWriter(buffer, fieldnames=COLUNAS_EXPORTACAO, delimiter=";", extrasaction="ignore")
+    writer.writeheader()
+    writer.writerows(docs)
+    return "\ufeff" + buffer.getvalue()
+
+@app.get("/api/documentos/exportar")
+async def export_documentos(desde: str, ate: str = None, status: str = None):
+    """Exporta o rastreio do período em CSV, incluindo os arquivos mensais"""
+    _validar_periodo(desde, ate)
+    conteudo = await run_db(_exportar_csv, desde, ate, status)
+    nome = f"rastreio_{desde}_{ate or datetime.now().strftime('%Y-%m-%d')}.csv"
+    return Response(content=conteudo, media_type="text/csv; charset=utf-8",
+                    headers={"Content-Disposition": f'attachment; filename="{nome}"'})
+
+@app.get("/api/documentos/busca")
+async def search_documentos(q: str, pagina: int = 1, por_pagina: int = 50, status: str = None, fase: str = None):
+    """Busca de texto no rastreio (código, produto, arquivo, pasta, usuários), paginada por relevância"""
+    pagina = max(pagina, 1)
+    por_pagina = min(max(por_pagina, 1), 500)
+    resultado = await run_db(buscar_documentos_texto, q, pagina, por_pagina, status, fase)
+    return {"query": q, "pagina": pagina, "por_pagina": por_pagina, **resultado}
+
 @app.post("/api/documentos/status")
 async def update_status(request: StatusUpdateRequest, authorization: str = Header(default=None)):
     """Atualiza status de um documento (entregue → baixado)"""
@@ -387,11 +606,11 @@ async def update_status(request: StatusUpdateRequest, authorization: str = Heade
     if not usuario_id:
         raise HTTPException(status_code=401, detail="Não autorizado")
 
-    ok = atualizar_status_documento(request.codigo_rastreio, request.novo_status, usuario_id)
+    ok = await run_db(atualizar_status_documento, request.codigo_rastreio, request.novo_status, usuario_id)
     if not ok:
         raise HTTPException(status_code=400, detail="Documento não encontrado ou status inválido para esta transição")
 
-    doc = buscar_documento(request.codigo_rastreio)
+    doc = await run_db(buscar_documento, request.codigo_rastreio)
     return {"success": True, "documento": doc}
 
 @app.post("/api/documentos/fase")
@@ -405,16 +624,23 @@ async def update_fase(request: FaseUpdateRequest, authorization: str = Header(de
     if request.fase not in fases_validas:
         raise HTTPException(status_code=400, detail="Fase inválida")
 
-    affected = atualizar_fase_documento(request.codigo_rastreio, request.fase, request.por_produto)
+    affected = await run_db(atualizar_fase_documento, request.codigo_rastreio, request.fase, request.por_produto, usuario_id)
     if affected == 0:
         raise HTTPException(status_code=404, detail="Documento não encontrado")
 
     return {"success": True, "affected": affected}
 
+@app.get("/api/notificacoes")
+async def notifications_status(authorization: str = Header(default=None)):
+    """Contagem do outbox de notificações por status"""
+    if not _get_user_payload(authorization):
+        raise HTTPException(status_code=401, detail="Não autorizado")
+    return {"smtp": outbox_sender.host, "destinatarios": DESTINATARIOS_FASE, "outbox": await run_db(resumo_outbox)}
+
 @app.get("/api/documentos/{codigo}")
 async def get_documento(codigo: str):
     """Busca um documento pelo código de rastreio"""
-    doc = buscar_documento(codigo)
+    doc = await run_db(buscar_documento, codigo)
     if not doc:
         raise HTTPException(status_code=404, detail="Documento não encontrado")
     return doc
@@ -422,24 +648,56 @@ async def get_documento(codigo: str):
 # --- IMPRESSÃO ---
 
 @app.get("/", response_class=HTMLResponse)
-async def root():
-    return FileResponse("static/index.html")
+async def root(request: Request):
+    return await run_share(index_response, request)
+
+@app.get("/api/ready")
+async def readiness():
+    """Estado do aquecimento em segundo plano; 503 enquanto não terminou"""
+    status = warmup.status()
+    return JSONResponse(status_code=200 if status["pronto"] else 503, content=status)
 
 @app.get("/api/printers")
 async def list_printers():
-    printers = get_available_printers()
+    printers = await run_share(get_available_printers)
     return {"printers": printers, "default": DEFAULT_PRINTER}
 
+@app.post("/api/cache/invalidar")
+async def invalidate_caches(authorization: str = Header(default=None)):
+    """Descarta impressoras, varreduras e catálogo em cache em todos os workers"""
+    if not _get_user_payload(authorization):
+        raise HTTPException(status_code=401, detail="Não autorizado")
+    await run_db(printers_cache.invalidate)
+    await run_db(scan_cache.invalidate)
+    await run_db(catalog_cache.invalidate)
+    return {"success": True}
+
+@app.get("/api/filtros")
+async def get_filtros():
+    """Regras de filtro em uso (recarrega filtros.json se mudou)"""
+    regras = await run_db(filter_rules.current)
+    return {"arquivo": str(filter_rules.path), "carregado_em": filter_rules.carregado_em, **regras.como_dict()}
+
 @app.post("/api/list-pdfs")
 async def list_pdfs(request: FolderRequest):
     try:
-        pdfs = find_pdf_files(request.path)
+        pdfs = await run_share(find_pdf_files, request.path)
         return {"success": True, "folder": request.path, "total": len(pdfs), "files": pdfs}
+    except PoolSaturado:
+        raise
     except FileNotFoundError as e:
         raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/list-pdfs/stream")
+async def list_pdfs_stream(request: FolderRequest):
+    """Mesma busca do /api/list-pdfs, mas emite cada PDF em NDJSON assim que é encontrado"""
+    if not await run_share(Path(request.path).exists):
+        raise HTTPException(status_code=404, detail=f"Pasta não encontrada: {request.path}")
+    linhas = share_pool.stream(stream_pdf_files, request.path)
+    return StreamingResponse(linhas, media_type="application/x-ndjson")
+
 
 def _get_user_id(authorization: str) -> int | None:
     """Extrai user_id do token JWT"""
@@ -466,71 +724,156 @@ def _get_user_payload(authorization: str) -> dict | None:
         return None
 
 
+def _print_one(pdf: dict, codigo: str, request: PrintRequest) -> tuple[dict, dict | None]:
+    """Carimba e imprime um PDF (thread do pool de impressão). Devolve (resultado, assinatura do original)."""
+    # Assinatura do original, antes do carimbo: base do modo "só alterados" nas próximas impressões
+    assinatura = pdf.get("assinatura")
+    if assinatura is None:
+        try:
+            assinatura = assinatura_pdf(pdf["path"])
+        except OSError:
+            assinatura = None
+
+    # Tenta carimbar o PDF
+    pdf_para_imprimir = stamp_pdf(pdf["path"], codigo, request.fase)
+    usou_tmp = pdf_para_imprimir is not None
+
+    if not usou_tmp:
+        pdf_para_imprimir = pdf["path"]  # fallback sem carimbo
+
+    try:
+        result = print_pdf(pdf_para_imprimir, request.printer)
+    finally:
+        # Limpa arquivo temporário
+        if usou_tmp:
+            try:
+                os.unlink(pdf_para_imprimir)
+            except:
+                pass
+    result["codigo_rastreio"] = codigo
+    return {"file": pdf["name"], "path": pdf["path"], **result}, assinatura
+
+
+# Registros de impressão em andamento: referência até terminarem, mesmo que o cliente desista
+_registros_pendentes: set[asyncio.Task] = set()
+
+
+async def _print_job(pdf: dict, codigo: str, request: PrintRequest, produto: str,
+                     computador: str, usuario_id: int) -> tuple[dict, asyncio.Task | None]:
+    """
+    Um arquivo da fila: imprime no pool de impressão e dispara o registro no rastreio em
+    outra tarefa. A fila da impressora não espera o banco: segue para o próximo arquivo.
+    Devolve (resultado, tarefa do registro ou None se não imprimiu).
+    """
+    result, assinatura = await run_print(_print_one, pdf, codigo, request)
+    if not result["success"]:
+        return result, None
+
+    registro = partial(
+        registrar_documento_impresso,
+        codigo_rastreio=codigo,
+        produto=produto,
+        arquivo=pdf["name"],
+        pasta=request.folder_path,
+        impressora=request.printer or "Padrão",
+        computador=computador,
+        usuario_id=usuario_id,
+        fase=request.fase,
+        assinatura=assinatura,
+        arquivo_relativo=pdf["relativo"]
+    )
+    tarefa = asyncio.create_task(_record_print(result, registro, pdf["name"], codigo))
+    _registros_pendentes.add(tarefa)
+    tarefa.add_done_callback(_registros_pendentes.discard)
+    return result, tarefa
+
+
+async def _record_print(result: dict, registro: partial, nome: str, codigo: str):
+    """Grava a impressão pelo pool do banco e marca result["registrado"]"""
+    # O papel já saiu: uma falha aqui não é falha de impressão, é "impresso sem registro"
+    erro = None
+    for tentativa in range(5):
+        try:
+            await run_db(registro)
+            result["registrado"] = True
+            return
+        except PoolSaturado as e:
+            erro = e
+            if tentativa < 4:
+                await asyncio.sleep(1 + tentativa)  # banco ocupado: espera vaga em vez de perder o registro
+        except Exception as e:
+            erro = e
+            break
+    result["registrado"] = False
+    result["erro_registro"] = str(erro)
+    print(f"AVISO: {nome} impresso com {codigo}, mas não registrado no rastreio: {erro}")
+
+
 @app.post("/api/print")
-async def print_files(request: PrintRequest, authorization: str = Header(default=None)):
+async def print_files(request: PrintRequest, http_request: Request, authorization: str = Header(default=None)):
     """Imprime PDFs selecionados — com carimbo de rastreio e registro no banco"""
     try:
         if request.selected_files:
             pdfs = [{"path": f, "name": Path(f).name} for f in request.selected_files]
         else:
-            pdfs = find_pdf_files(request.folder_path)
+            pdfs = await run_share(find_pdf_files, request.folder_path)
 
         if not pdfs:
             return {"success": False, "message": "Nenhum PDF para imprimir"}
 
+        produto = Path(request.folder_path).name
+        # Cópias: os dicts de find_pdf_files são os do cache de varredura
+        pdfs = [{**pdf, "relativo": caminho_relativo(pdf["path"], request.folder_path)} for pdf in pdfs]
+        inalterados = []
+        if request.apenas_alterados:
+            anteriores = await run_db(ultimas_assinaturas, produto)
+            pdfs, inalterados = await run_share(separar_alterados, pdfs, anteriores)
+            if not pdfs:
+                return {
+                    "success": True,
+                    "message": "Nenhum PDF alterado desde a última impressão",
+                    "total": 0, "printed": 0, "failed": 0, "results": [], "codigos_rastreio": [],
+                    "unchanged": inalterados,
+                }
+
         payload = _get_user_payload(authorization)
         usuario_id = payload["user_id"] if payload else 1
         computador = get_hostname()
-        produto = Path(request.folder_path).name
 
-        results = []
-        success_count = 0
-        codigos_gerados = []
-        arquivos_tmp = []
+        # Revezamento por usuário + terminal: com o login desativado todos são o mesmo usuário
+        terminal = http_request.client.host if http_request.client else "?"
+        # Lugar na fila primeiro: um lote recusado (429) não gasta códigos de rastreio
+        with print_scheduler.reservar(request.printer or "Padrão", f"{usuario_id}@{terminal}", len(pdfs)) as reserva:
+            # Reserva os códigos do lote numa só transação (um código único por arquivo)
+            codigos = await run_db(reservar_codigos_rastreio, NODE_ID, len(pdfs))
+            resultados = await reserva.submit([
+                partial(_print_job, pdf, codigo, request, produto, computador, usuario_id)
+                for pdf, codigo in zip(pdfs, codigos)
+            ], urgente=request.urgente)
 
-        for pdf in pdfs:
-            # Gera código de rastreio único por arquivo
-            codigo = gerar_codigo_rastreio(computador)
-
-            # Tenta carimbar o PDF
-            pdf_para_imprimir = stamp_pdf(pdf["path"], codigo, request.fase)
-            usou_tmp = pdf_para_imprimir is not None
-
-            if not usou_tmp:
-                pdf_para_imprimir = pdf["path"]  # fallback sem carimbo
-            else:
-                arquivos_tmp.append(pdf_para_imprimir)
-
-            result = print_pdf(pdf_para_imprimir, request.printer)
-            result["codigo_rastreio"] = codigo
-            results.append({"file": pdf["name"], **result})
-
-            if result["success"]:
-                success_count += 1
-                codigos_gerados.append(codigo)
-                # Registra no banco de rastreio
-                registrar_documento_impresso(
-                    codigo_rastreio=codigo,
-                    produto=produto,
-                    arquivo=pdf["name"],
-                    pasta=request.folder_path,
-                    impressora=request.printer or "Padrão",
-                    computador=computador,
-                    usuario_id=usuario_id,
-                    fase=request.fase
-                )
-
-        # Limpa arquivos temporários
-        for tmp in arquivos_tmp:
-            try:
-                os.unlink(tmp)
-            except:
-                pass
+        results = []
+        for r, pdf, codigo in zip(resultados, pdfs, codigos):
+            if isinstance(r, Exception):
+                results.append({"file": pdf["name"], "path": pdf["path"], "success": False,
+                                "error": str(r), "codigo_rastreio": codigo})
+                continue
+            result, registro = r
+            if registro is not None:
+                # shield: se o cliente desistir, o registro termina mesmo assim
+                await asyncio.shield(registro)
+            results.append(result)
+        success_count = sum(1 for r in results if r["success"])
+        codigos_gerados = [r["codigo_rastreio"] for r in results if r["success"] and r.get("registrado")]
+        nao_registrados = [
+            {"file": r["file"], "codigo_rastreio": r["codigo_rastreio"], "erro": r["erro_registro"]}
+            for r in results if r["success"] and not r.get("registrado")
+        ]
 
         # Registra log geral (compatibilidade)
         try:
             arquivos_ok = [r["file"] for r in results if r.get("success")]
-            registrar_log(
+            await run_db(
+                registrar_log,
                 usuario_id=usuario_id,
                 produto=produto,
                 pasta=request.folder_path,
@@ -546,59 +889,159 @@ async def print_files(request: PrintRequest, authorization: str = Header(default
             "printed": success_count,
             "failed": len(pdfs) - success_count,
             "results": results,
-            "codigos_rastreio": codigos_gerados
+            "codigos_rastreio": codigos_gerados,
+            "nao_registrados": nao_registrados,
+            "unchanged": inalterados
         }
 
+    except (PoolSaturado, FilaCheia):
+        raise
     except FileNotFoundError as e:
         raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.get("/api/search")
-async def search_products(query: str = ""):
-    if not query or len(query) < 3:
-        return {"success": False, "message": "Digite pelo menos 3 caracteres", "results": []}
+@app.get("/api/metricas/fila")
+async def print_queue_metrics():
+    """Profundidade e tempo de espera das filas de impressão"""
+    return print_scheduler.metricas()
+
+
+def count_product_pdfs(product: Path) -> int:
+    """
+    Conta os PDFs das pastas ENG* do produto. As regras valem para cada pasta e
+    arquivo abaixo do produto (não para o caminho do compartilhamento), e as
+    pastas ignoradas nem chegam a ser percorridas.
+    """
+    regras = filter_rules.current()
+    total = 0
+    for sub in product.iterdir():
+        if not (sub.is_dir() and sub.name.upper().startswith("ENG")) or regras.ignore_folder(sub.name):
+            continue
+        for _, pastas, arquivos in os.walk(sub):
+            pastas[:] = [p for p in pastas if not regras.ignore_folder(p)]
+            total += sum(1 for a in arquivos if a.lower().endswith(".pdf") and not regras.ignore_pdf(a))
+    return total
+
+
+def _eh_produto(pasta: Path) -> bool:
+    return pasta.name[:9].isdigit() and len(pasta.name) >= 9
 
-    results = []
 
+def _subpastas(pasta: Path) -> list[Path]:
+    """Subpastas de uma raiz ou categoria, pelo cache do catálogo"""
+    chave = str(pasta)
+    nomes = catalog_cache.get(chave)
+    if nomes is None:
+        nomes = [item.name for item in pasta.iterdir() if item.is_dir()]
+        catalog_cache.set(chave, nomes)
+    return [pasta / nome for nome in nomes]
+
+
+def preload_catalog() -> dict:
+    """
+    Preenche o cache do catálogo com as pastas de status/categoria de cada raiz,
+    para que a primeira busca não precise listar o compartilhamento.
+    """
+    pastas = 0
     for search_path in SEARCH_PATHS:
         status_path = Path(search_path)
         if not status_path.exists():
             continue
+        for item in _subpastas(status_path):
+            pastas += 1
+            if not _eh_produto(item):
+                pastas += len(_subpastas(item))
+    return {"pastas": pastas}
+
+
+def _resultado_produto(product: Path, status_name: str) -> dict:
+    return {
+        "name": product.name, "path": str(product),
+        "type": "PRODUTO", "status": status_name, "pdf_count": count_product_pdfs(product)
+    }
+
+
+def _listar_raiz(search_path: str, query: str) -> tuple[str, list[dict], list[Path]]:
+    """(status, produtos da raiz que batem com a busca, pastas de categoria a percorrer)"""
+    status_path = Path(search_path)
+    if not status_path.exists():
+        raise FileNotFoundError(f"Raiz não encontrada: {search_path}")
+
+    status_name = status_path.name.split(" - ")[1] if " - " in status_path.name else status_path.name
+
+    results, categorias = [], []
+    for item in _subpastas(status_path):
+        if not _eh_produto(item):
+            categorias.append(item)
+        elif query.upper() in item.name.upper():
+            results.append(_resultado_produto(item, status_name))
+    return status_name, results, categorias
+
+
+def _search_category(categoria: Path, query: str, status_name: str) -> list[dict]:
+    return [
+        _resultado_produto(product_folder, status_name)
+        for product_folder in _subpastas(categoria)
+        if query.upper() in product_folder.name.upper()
+    ]
 
-        status_name = status_path.name.split(" - ")[1] if " - " in status_path.name else status_path.name
 
-        for item in status_path.iterdir():
-            if not item.is_dir():
-                continue
+async def _search_root(search_path: str, query: str) -> list[dict]:
+    """Uma raiz: lista os produtos soltos e percorre as categorias em paralelo (até PARALELO_RAIZ)"""
+    status_name, results, categorias = await run_share(_listar_raiz, search_path, query)
+    limite = asyncio.Semaphore(PARALELO_RAIZ)
 
-            is_product = item.name[:9].isdigit() and len(item.name) >= 9
-
-            if is_product:
-                if query.upper() in item.name.upper():
-                    pdf_count = sum(1 for sub in item.iterdir()
-                                   if sub.is_dir() and sub.name.upper().startswith("ENG")
-                                   for p in sub.rglob("*.pdf") if not any(termo in str(p).upper() for termo in IGNORAR_PASTAS))
-                    results.append({
-                        "name": item.name, "path": str(item),
-                        "type": "PRODUTO", "status": status_name, "pdf_count": pdf_count
-                    })
-            else:
-                for product_folder in item.iterdir():
-                    if not product_folder.is_dir():
-                        continue
-                    if query.upper() in product_folder.name.upper():
-                        pdf_count = sum(1 for sub in product_folder.iterdir()
-                                       if sub.is_dir() and sub.name.upper().startswith("ENG")
-                                       for p in sub.rglob("*.pdf") if not any(termo in str(p).upper() for termo in IGNORAR_PASTAS))
-                        results.append({
-                            "name": product_folder.name, "path": str(product_folder),
-                            "type": "PRODUTO", "status": status_name, "pdf_count": pdf_count
-                        })
-
-    results.sort(key=lambda x: (x["status"], x["name"]))
-    return {"success": True, "query": query, "total": len(results), "results": results[:20]}
+    async def categoria(pasta: Path) -> list[dict]:
+        async with limite:
+            return await run_share(_search_category, pasta, query, status_name)
+
+    for encontrados in await asyncio.gather(*(categoria(c) for c in categorias)):
+        results.extend(encontrados)
+    return results
+
+
+@app.get("/api/search")
+async def search_products(query: str = ""):
+    if not query or len(query) < 3:
+        return {"success": False, "message": "Digite pelo menos 3 caracteres", "results": []}
+
+    results, raizes = await busca_raizes.executar(SEARCH_PATHS, lambda raiz: _search_root(raiz, query))
+    return {
+        "success": True, "query": query, "total": len(results),
+        # Só os 20 primeiros na ordem (status, nome): sem ordenar a lista inteira
+        "results": heapq.nsmallest(20, results, key=lambda x: (x["status"], x["name"])),
+        "parcial": any(r["status"] != "ok" for r in raizes),
+        "raizes": raizes,
+    }
+
+
+@app.get("/api/metricas/busca")
+async def search_metrics():
+    """Latência e prazos estourados por raiz da busca de produtos"""
+    return busca_raizes.metricas()
+
+
+def _browse_folder(path: str) -> dict:
+    folder = Path(path)
+
+    if not folder.exists():
+        raise FileNotFoundError("Pasta não encontrada")
+
+    items = []
+    for item in sorted(folder.iterdir()):
+        if item.is_dir():
+            pdf_count = 0
+            for subdir in item.iterdir():
+                if subdir.is_dir() and subdir.name.upper().startswith("ENG"):
+                    pdf_count += len(list(subdir.glob("*.pdf")))
+            items.append({
+                "name": item.name, "path": str(item),
+                "is_dir": True, "pdf_count": pdf_count
+            })
+
+    return {"current": str(folder), "parent": str(folder.parent) if folder.parent != folder else None, "items": items}
 
 
 @app.get("/api/browse")
@@ -607,32 +1050,19 @@ async def browse_folder(path: str = ""):
         if not path:
             path = SEARCH_PATHS[0]
 
-        folder = Path(path)
-
-        if not folder.exists():
-            raise HTTPException(status_code=404, detail="Pasta não encontrada")
-
-        items = []
-        for item in sorted(folder.iterdir()):
-            if item.is_dir():
-                pdf_count = 0
-                for subdir in item.iterdir():
-                    if subdir.is_dir() and subdir.name.upper().startswith("ENG"):
-                        pdf_count += len(list(subdir.glob("*.pdf")))
-                items.append({
-                    "name": item.name, "path": str(item),
-                    "is_dir": True, "pdf_count": pdf_count
-                })
-
-        return {"current": str(folder), "parent": str(folder.parent) if folder.parent != folder else None, "items": items}
+        return await run_share(_browse_folder, path)
 
+    except PoolSaturado:
+        raise
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
     except PermissionError:
         raise HTTPException(status_code=403, detail="Sem permissão para acessar esta pasta")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-app.mount("/static", StaticFiles(directory="static"), name="static")
+app.mount("/static", CachedStaticFiles(directory="static"), name="static")
 
 
 if __name__ == "__main__":
@@ -645,4 +1075,9 @@ if __name__ == "__main__":
     print(f"   http://SEU_IP:8000")
     print("\n" + "="*50 + "\n")
 
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    if WORKERS > 1:
+        # Com vários workers o uvicorn precisa importar o app pelo nome
+        print(f"⚙️  Modo multi-worker: {WORKERS} processos (nó {NODE_ID})\n")
+        uvicorn.run("main:app", host="0.0.0.0", port=8000, workers=WORKERS)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8000)
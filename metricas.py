@@ -0,0 +1,11 @@
+"""
+Estatísticas simples para as métricas expostas pela API (fila, busca) e pelo teste de carga
+"""
+
+
+def percentil(valores: list[float], p: float) -> float | None:
+    """Percentil p (0-100) pelo valor mais próximo da posição; None sem amostras"""
+    if not valores:
+        return None
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))]
@@ -0,0 +1,119 @@
+"""
+Envio das notificações do outbox
+Um laço em segundo plano lê o outbox, junta os eventos de um mesmo produto e
+destinatário num único e-mail (resumo) e envia por SMTP. Falhas voltam para a
+fila com backoff exponencial.
+
+Para testar localmente, suba um SMTP de mentira e aponte FASTPRINT_SMTP_HOST/PORT para ele:
+    python -m aiosmtpd -n -l localhost:1025
+"""
+
+import asyncio
+import os
+import smtplib
+from collections import defaultdict
+from email.message import EmailMessage
+
+from database import reservar_notificacoes, renovar_notificacoes, marcar_notificacoes_enviadas, adiar_notificacoes
+
+SMTP_HOST = os.environ.get("FASTPRINT_SMTP_HOST")
+SMTP_PORT = int(os.environ.get("FASTPRINT_SMTP_PORT", 25))
+SMTP_USUARIO = os.environ.get("FASTPRINT_SMTP_USUARIO")
+SMTP_SENHA = os.environ.get("FASTPRINT_SMTP_SENHA")
+SMTP_STARTTLS = os.environ.get("FASTPRINT_SMTP_STARTTLS", "0") == "1"
+REMETENTE = os.environ.get("FASTPRINT_SMTP_REMETENTE", "fastprint@lineabrasil.com.br")
+
+
+def montar_resumo(produto: str, destinatario: str, eventos: list[dict]) -> EmailMessage:
+    """Um e-mail com todas as mudanças de fase de um produto"""
+    msg = EmailMessage()
+    msg["From"] = REMETENTE
+    msg["To"] = destinatario
+    resumo = f" ({len(eventos)} alterações)" if len(eventos) > 1 else ""
+    msg["Subject"] = f"[FastPrint] {produto}: fase alterada para {eventos[-1]['dados']['fase']}{resumo}"
+
+    linhas = [f"Mudanças de fase no produto {produto}:", ""]
+    for e in eventos:
+        d = e["dados"]
+        quem = f" por {d['usuario']}" if d.get("usuario") else ""
+        if d.get("por_produto"):
+            linhas.append(f"- {d['em']}: {d['documentos']} documento(s) do produto → {d['fase']}{quem}")
+        else:
+            anterior = d.get("fase_anterior") or "sem fase"
+            linhas.append(f"- {d['em']}: {d['codigo_rastreio']} ({d['arquivo']}): {anterior} → {d['fase']}{quem}")
+    linhas += ["", "Mensagem automática do FastPrint."]
+    msg.set_content("\n".join(linhas))
+    return msg
+
+
+class OutboxSender:
+    def __init__(self, host: str = SMTP_HOST, port: int = SMTP_PORT, intervalo_s: float = 30,
+                 max_tentativas: int = 8, backoff_base_s: int = 60, backoff_max_s: int = 3600,
+                 lease_s: int = 300):
+        self.host = host
+        self.port = port
+        self.intervalo_s = intervalo_s
+        self.lease_s = lease_s
+        self.max_tentativas = max_tentativas
+        self.backoff_base_s = backoff_base_s
+        self.backoff_max_s = backoff_max_s
+
+    def _conectar(self) -> smtplib.SMTP:
+        smtp = smtplib.SMTP(self.host, self.port, timeout=30)
+        if SMTP_STARTTLS:
+            smtp.starttls()
+        if SMTP_USUARIO:
+            smtp.login(SMTP_USUARIO, SMTP_SENHA or "")
+        return smtp
+
+    def processar(self) -> dict:
+        """Uma rodada: reserva, agrupa, envia e marca. Síncrono (roda fora do event loop)."""
+        eventos = reservar_notificacoes(lease_s=self.lease_s)
+        if not eventos:
+            return {"eventos": 0, "emails": 0, "falhas": 0, "ignorados": 0}
+
+        grupos = defaultdict(list)
+        for e in eventos:
+            grupos[(e["produto"], e["destinatario"])].append(e)
+
+        enviados, falhas, ignorados = 0, 0, 0
+        smtp = None
+        try:
+            for (produto, destinatario), grupo in grupos.items():
+                ids = [e["id"] for e in grupo]
+                # Renova o lease antes de cada envio: numa rodada longa (SMTP lento) o lease dos
+                # últimos grupos venceria e outro worker os enviaria de novo
+                if renovar_notificacoes(ids, grupo[0]["reserva"], self.lease_s) is None:
+                    ignorados += 1  # já é de outro worker
+                    continue
+                try:
+                    if smtp is None:
+                        smtp = self._conectar()
+                    smtp.send_message(montar_resumo(produto, destinatario, grupo))
+                except (smtplib.SMTPException, OSError) as e:
+                    falhas += 1
+                    adiar_notificacoes(ids, str(e), self.max_tentativas, self.backoff_base_s, self.backoff_max_s)
+                    if isinstance(e, (OSError, smtplib.SMTPServerDisconnected)):
+                        smtp = None  # reconecta no próximo grupo
+                    continue
+                marcar_notificacoes_enviadas(ids)
+                enviados += 1
+        finally:
+            if smtp is not None:
+                try:
+                    smtp.quit()
+                except (smtplib.SMTPException, OSError):
+                    pass
+        return {"eventos": len(eventos), "emails": enviados, "falhas": falhas, "ignorados": ignorados}
+
+    async def executar(self):
+        # Thread própria (não os pools da API): um SMTP lento não tira capacidade das rotas
+        while True:
+            try:
+                await asyncio.to_thread(self.processar)
+            except Exception as e:
+                print(f"Erro no envio de notificações: {e}")
+            await asyncio.sleep(self.intervalo_s)
+
+
+outbox_sender = OutboxSender()
@@ -0,0 +1,236 @@
+"""
+Escalonador de impressão
+Fila por impressora com revezamento (round-robin) entre usuários: cada arquivo
+é uma tarefa, então um lote de 300 PDFs não segura o desenho urgente de outra pessoa.
+Impressões urgentes passam à frente das normais. A fila tem profundidade máxima;
+acima dela a requisição é recusada (429) em vez de esperar indefinidamente.
+
+A fila vive no processo: com vários workers, cada um escalona as suas requisições.
+"""
+
+import asyncio
+import os
+import time
+from collections import OrderedDict, deque
+
+from metricas import percentil
+
+
+class FilaCheia(Exception):
+    """Fila da impressora (ou cota do usuário) sem espaço para o lote"""
+
+    def __init__(self, mensagem: str, retry_after: int):
+        super().__init__(mensagem)
+        self.retry_after = retry_after
+
+
+class _Tarefa:
+    __slots__ = ("fn", "futuro", "enfileirada_em")
+
+    def __init__(self, fn, futuro):
+        self.fn = fn
+        self.futuro = futuro
+        self.enfileirada_em = time.monotonic()
+
+
+class _FilaImpressora:
+    """Filas por usuário (urgente e normal) de uma impressora, atendidas em revezamento"""
+
+    def __init__(self, nome: str):
+        self.nome = nome
+        self.urgentes: OrderedDict[str, deque] = OrderedDict()
+        self.normais: OrderedDict[str, deque] = OrderedDict()
+        self.pendentes = 0
+        self.reservados = 0                     # lugares de lotes admitidos que ainda vão entrar
+        self.sinal = asyncio.Event()
+        self.worker: asyncio.Task | None = None
+        self.esperas = deque(maxlen=1000)       # segundos entre enfileirar e começar
+        self.servicos = deque(maxlen=200)       # segundos de carimbo + impressão
+        self.processadas = 0
+        self.recusadas = 0
+
+    def adicionar(self, usuario: str, tarefas: list[_Tarefa], urgente: bool):
+        filas = self.urgentes if urgente else self.normais
+        filas.setdefault(usuario, deque()).extend(tarefas)
+        self.pendentes += len(tarefas)
+        self.sinal.set()
+
+    def proxima(self) -> _Tarefa | None:
+        for filas in (self.urgentes, self.normais):
+            while filas:
+                usuario, fila = next(iter(filas.items()))
+                tarefa = fila.popleft()
+                # O usuário atendido vai para o fim da vez
+                if fila:
+                    filas.move_to_end(usuario)
+                else:
+                    del filas[usuario]
+                self.pendentes -= 1
+                if not tarefa.futuro.cancelled():
+                    return tarefa
+        return None
+
+    def tempo_medio_servico(self) -> float:
+        return sum(self.servicos) / len(self.servicos) if self.servicos else 5.0
+
+    def metricas(self) -> dict:
+        esperas = list(self.esperas)
+        return {
+            "impressora": self.nome,
+            "na_fila": self.pendentes,
+            "reservados": self.reservados,
+            "usuarios_na_fila": len(set(self.urgentes) | set(self.normais)),
+            "processadas": self.processadas,
+            "recusadas": self.recusadas,
+            "espera_s": {
+                "media": round(sum(esperas) / len(esperas), 3) if esperas else None,
+                "p50": percentil(esperas, 50),
+                "p95": percentil(esperas, 95),
+                "max": max(esperas) if esperas else None,
+                "amostras": len(esperas),
+            },
+            "servico_medio_s": round(self.tempo_medio_servico(), 3),
+        }
+
+
+class _Reserva:
+    """Lugar na fila de uma impressora para um lote já admitido (ver PrintScheduler.reservar)"""
+
+    def __init__(self, scheduler: "PrintScheduler", fila: _FilaImpressora, usuario: str, quantidade: int):
+        self._scheduler = scheduler
+        self._fila = fila
+        self._usuario = usuario
+        self._restante = quantidade
+        self._ativa = True
+
+    async def submit(self, trabalhos: list, urgente: bool = False) -> list:
+        """Enfileira o lote no lugar reservado e aguarda os resultados (ver PrintScheduler.submit_batch)"""
+        if not self._ativa or len(trabalhos) > self._restante:
+            raise ValueError("Lote maior que a reserva ou reserva já liberada")
+        loop = asyncio.get_running_loop()
+        tarefas = [_Tarefa(fn, loop.create_future()) for fn in trabalhos]
+        self._restante -= len(tarefas)
+        self._fila.reservados -= len(tarefas)
+        try:
+            self._fila.adicionar(self._usuario, tarefas, urgente)
+            return await asyncio.gather(*(t.futuro for t in tarefas), return_exceptions=True)
+        finally:
+            # Se o cliente desistiu, as tarefas canceladas são puladas pelo worker
+            for t in tarefas:
+                t.futuro.cancel()
+
+    def liberar(self):
+        """Devolve o que não foi usado e encerra o lote do usuário (idempotente)"""
+        if not self._ativa:
+            return
+        self._ativa = False
+        self._fila.reservados -= self._restante
+        self._restante = 0
+        lotes = self._scheduler._lotes_usuario
+        lotes[self._usuario] -= 1
+        if not lotes[self._usuario]:
+            del lotes[self._usuario]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.liberar()
+
+
+class PrintScheduler:
+    def __init__(self, max_fila_impressora: int = 500, max_lotes_usuario: int = 3):
+        """
+        max_fila_impressora: arquivos aguardando por impressora.
+        max_lotes_usuario: lotes simultâneos de um mesmo usuário (em todas as impressoras).
+        """
+        self.max_fila_impressora = max_fila_impressora
+        self.max_lotes_usuario = max_lotes_usuario
+        self._filas: dict[str, _FilaImpressora] = {}
+        self._lotes_usuario: dict[str, int] = {}
+
+    def _fila(self, impressora: str) -> _FilaImpressora:
+        fila = self._filas.get(impressora)
+        if fila is None:
+            fila = self._filas[impressora] = _FilaImpressora(impressora)
+        if fila.worker is None or fila.worker.done():
+            fila.worker = asyncio.create_task(self._atender(fila))
+        return fila
+
+    async def _atender(self, fila: _FilaImpressora):
+        # Um arquivo por vez por impressora: o spooler imprime em série de qualquer forma
+        while True:
+            tarefa = fila.proxima()
+            if tarefa is None:
+                fila.sinal.clear()
+                await fila.sinal.wait()
+                continue
+            inicio = time.monotonic()
+            fila.esperas.append(round(inicio - tarefa.enfileirada_em, 3))
+            try:
+                resultado = await tarefa.fn()
+            except Exception as e:
+                if not tarefa.futuro.done():
+                    tarefa.futuro.set_exception(e)
+            else:
+                if not tarefa.futuro.done():
+                    tarefa.futuro.set_result(resultado)
+            fila.servicos.append(time.monotonic() - inicio)
+            fila.processadas += 1
+
+    def reservar(self, impressora: str, usuario: str, quantidade: int) -> _Reserva:
+        """
+        Admite um lote de `quantidade` arquivos antes de montá-lo: levanta FilaCheia se não
+        couber, senão guarda o lugar até reserva.submit() ou reserva.liberar(). Serve para não
+        gastar nada (ex.: códigos de rastreio) com um lote que seria recusado. Use com `with`.
+        """
+        fila = self._fila(impressora)
+
+        if self._lotes_usuario.get(usuario, 0) >= self.max_lotes_usuario:
+            fila.recusadas += 1
+            raise FilaCheia(f"Você já tem {self.max_lotes_usuario} lotes em andamento. Aguarde terminarem.",
+                            retry_after=max(1, int(fila.tempo_medio_servico())))
+        ocupados = fila.pendentes + fila.reservados
+        if ocupados + quantidade > self.max_fila_impressora:
+            fila.recusadas += 1
+            livre = max(0, self.max_fila_impressora - ocupados)
+            raise FilaCheia(
+                f"Fila da impressora {impressora} cheia ({ocupados} arquivos aguardando, "
+                f"cabem mais {livre}). Tente novamente mais tarde ou divida o lote.",
+                retry_after=max(1, int(ocupados * fila.tempo_medio_servico())))
+
+        fila.reservados += quantidade
+        self._lotes_usuario[usuario] = self._lotes_usuario.get(usuario, 0) + 1
+        return _Reserva(self, fila, usuario, quantidade)
+
+    async def submit_batch(self, impressora: str, usuario: str, trabalhos: list, urgente: bool = False) -> list:
+        """
+        Enfileira um lote (lista de funções async sem argumento) e aguarda todos os resultados,
+        na ordem do lote. Um trabalho que falhou aparece como a exceção levantada. O trabalho
+        roda na tarefa da impressora: se o cliente desistir, o arquivo já em andamento termina
+        (e é registrado) mesmo assim. O trabalho não deve recusar por falta de thread (use um
+        pool sem limite de fila, como run_print): o que a fila aceitou espera, não falha.
+        Nem deve esperar por outra coisa (ex.: vaga no banco): enquanto roda, a impressora para.
+        Levanta FilaCheia antes de enfileirar qualquer coisa se não houver espaço.
+        """
+        with self.reservar(impressora, usuario, len(trabalhos)) as reserva:
+            return await reserva.submit(trabalhos, urgente)
+
+    def metricas(self) -> dict:
+        return {
+            "max_fila_impressora": self.max_fila_impressora,
+            "max_lotes_usuario": self.max_lotes_usuario,
+            "impressoras": [f.metricas() for f in self._filas.values()],
+        }
+
+    async def shutdown(self):
+        for fila in self._filas.values():
+            if fila.worker:
+                fila.worker.cancel()
+
+
+def criar_scheduler() -> PrintScheduler:
+    return PrintScheduler(
+        max_fila_impressora=int(os.environ.get("FASTPRINT_FILA_IMPRESSORA", 500)),
+        max_lotes_usuario=int(os.environ.get("FASTPRINT_LOTES_USUARIO", 3)),
+    )
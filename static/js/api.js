@@ -20,12 +20,46 @@ export async function apiListPdfs(path) {
     return response.json();
 }
 
-export async function apiPrint(folder_path, printer, selected_files, token, fase) {
+// Lê o NDJSON de /api/list-pdfs/stream chamando onRecord a cada linha completa
+export async function apiListPdfsStream(path, onRecord) {
+    const response = await fetch('/api/list-pdfs/stream', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ path }),
+    });
+    if (!response.ok) throw new Error((await response.json()).detail);
+
+    const reader  = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let summary = null;
+    const handle = line => {
+        if (!line.trim()) return;
+        const record = JSON.parse(line);
+        if (record.type === 'error') throw new Error(record.detail);
+        if (record.type === 'summary') summary = record;
+        onRecord(record);
+    };
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split('\n');
+        buffer = lines.pop();
+        lines.forEach(handle);
+    }
+    handle(buffer + decoder.decode());
+    return summary;
+}
+
+export async function apiPrint(folder_path, printer, selected_files, token, fase, urgente = false, apenas_alterados = false) {
     const response = await fetch('/api/print', {
         method: 'POST',
         headers: { 'Content-Type': 'application/json', 'Authorization': `Bearer ${token}` },
-        body: JSON.stringify({ folder_path, printer, selected_files, fase: fase || null }),
+        body: JSON.stringify({ folder_path, printer, selected_files, fase: fase || null, urgente, apenas_alterados }),
     });
+    // 429 = fila da impressora cheia, 503 = servidor ocupado
+    if (!response.ok) throw new Error((await response.json()).detail);
     return response.json();
 }
 
@@ -43,6 +77,14 @@ export async function apiGetDocumentos(limite = 500) {
     return response.json();
 }
 
+export async function apiBuscarDocumentos(q, pagina = 1, por_pagina = 200, status = null, fase = null) {
+    const params = new URLSearchParams({ q, pagina, por_pagina });
+    if (status) params.set('status', status);
+    if (fase)   params.set('fase', fase);
+    const response = await fetch(`/api/documentos/busca?${params}`);
+    return response.json();
+}
+
 export async function apiUpdateStatus(codigo_rastreio, novo_status, token) {
     const response = await fetch('/api/documentos/status', {
         method: 'POST',
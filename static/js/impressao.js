@@ -1,7 +1,7 @@
-import { state } from './state.js?v=2';
-import { apiSearch, apiGetPrinters, apiListPdfs, apiPrint } from './api.js?v=2';
-import { showToast, closeModal } from './ui.js?v=2';
-import { loadDocs } from './rastreio.js?v=2';
+import { state } from './state.js';
+import { apiSearch, apiGetPrinters, apiListPdfsStream, apiPrint } from './api.js';
+import { showToast, closeModal } from './ui.js';
+import { loadDocs } from './rastreio.js';
 
 export async function searchProducts(query) {
     const container = document.getElementById('searchResults');
@@ -9,11 +9,18 @@ export async function searchProducts(query) {
     container.innerHTML = '<div class="loading"><div class="spinner"></div>Buscando...</div>';
     try {
         const data = await apiSearch(query);
+        // Raízes que não responderam a tempo (ou fora do ar): o resultado pode estar incompleto
+        const faltando = (data.raizes || []).filter(r => r.status !== 'ok');
+        const aviso = faltando.length ? `
+            <div style="padding: 0.5rem 1rem; color: var(--warning); font-size: 0.8rem; border-bottom: 1px solid var(--border);">
+                ⚠️ Resultado parcial: ${faltando.map(r => r.raiz.split(/[\\/]/).pop()).join(', ')}
+                ${faltando.length > 1 ? 'não responderam' : 'não respondeu'} a tempo
+            </div>` : '';
         if (data.results.length === 0) {
-            container.innerHTML = `<div style="padding: 1rem; color: var(--text-secondary); text-align: center;">Nenhum produto encontrado</div>`;
+            container.innerHTML = aviso + `<div style="padding: 1rem; color: var(--text-secondary); text-align: center;">Nenhum produto encontrado</div>`;
             return;
         }
-        container.innerHTML = data.results.map(p => `
+        container.innerHTML = aviso + data.results.map(p => `
             <div class="search-result-item" onclick="selectProduct('${p.path.replace(/\\/g, '\\\\')}', '${p.name}')">
                 <div class="search-result-info"><h4>${p.name}</h4><span>${p.path}</span></div>
                 <div class="search-result-meta">
@@ -66,26 +73,33 @@ export async function scanFolder() {
     if (!path) { showToast('Digite o caminho da pasta', 'warning'); return; }
     document.getElementById('emptyState').style.display = 'none';
     document.getElementById('resultsSection').style.display = 'block';
-    document.getElementById('fileList').innerHTML = '<div class="loading"><div class="spinner"></div>Escaneando...</div>';
+    const container = document.getElementById('fileList');
+    container.innerHTML = '<div class="loading"><div class="spinner"></div>Escaneando...</div>';
+    state.currentFiles = [];
+    updateCounts();
     try {
-        const data = await apiListPdfs(path);
-        state.currentFiles = data.files.map(f => ({ ...f, selected: true }));
+        // Cada PDF é desenhado assim que chega; o resumo final reordena a lista
+        const summary = await apiListPdfsStream(path, record => {
+            if (record.type !== 'file') return;
+            if (state.currentFiles.length === 0) container.innerHTML = '';
+            const { type, ...file } = record;
+            state.currentFiles.push({ ...file, selected: true });
+            appendFile(state.currentFiles.length - 1);
+            updateCounts();
+        });
+        state.currentFiles.sort((a, b) => a.folder.localeCompare(b.folder) || a.name.localeCompare(b.name));
         renderFiles();
         updateCounts();
-        showToast(`${data.total} arquivos encontrados`, data.total > 0 ? 'success' : 'warning');
+        const total = summary ? summary.total : state.currentFiles.length;
+        showToast(`${total} arquivos encontrados`, total > 0 ? 'success' : 'warning');
     } catch (error) {
         showToast(error.message, 'error');
-        document.getElementById('fileList').innerHTML = `<div class="empty-state"><div class="empty-state-icon">❌</div><h3>Erro ao escanear</h3><p>${error.message}</p></div>`;
+        container.innerHTML = `<div class="empty-state"><div class="empty-state-icon">❌</div><h3>Erro ao escanear</h3><p>${error.message}</p></div>`;
     }
 }
 
-export function renderFiles() {
-    const container = document.getElementById('fileList');
-    if (state.currentFiles.length === 0) {
-        container.innerHTML = `<div class="empty-state"><div class="empty-state-icon">📭</div><h3>Nenhum PDF encontrado</h3><p>Não há PDFs nas pastas ENG</p></div>`;
-        return;
-    }
-    container.innerHTML = state.currentFiles.map((file, i) => `
+function fileItemHtml(file, i) {
+    return `
         <div class="file-item" id="file-${i}">
             <input type="checkbox" class="file-checkbox" ${file.selected ? 'checked' : ''} onchange="toggleFile(${i})">
             <div class="file-icon">PDF</div>
@@ -95,7 +109,20 @@ export function renderFiles() {
             </div>
             <div class="file-status pending" id="status-${i}">⏳</div>
         </div>
-    `).join('');
+    `;
+}
+
+function appendFile(i) {
+    document.getElementById('fileList').insertAdjacentHTML('beforeend', fileItemHtml(state.currentFiles[i], i));
+}
+
+export function renderFiles() {
+    const container = document.getElementById('fileList');
+    if (state.currentFiles.length === 0) {
+        container.innerHTML = `<div class="empty-state"><div class="empty-state-icon">📭</div><h3>Nenhum PDF encontrado</h3><p>Não há PDFs nas pastas ENG</p></div>`;
+        return;
+    }
+    container.innerHTML = state.currentFiles.map(fileItemHtml).join('');
 }
 
 export function toggleFile(i) {
@@ -137,6 +164,8 @@ export function printSelected() {
     document.getElementById('modalImpressora').textContent = impressora;
     document.getElementById('modalArquivos').textContent   = `${selected.length} arquivo(s)`;
     document.getElementById('modalFase').value = '';
+    document.getElementById('modalUrgente').checked = false;
+    document.getElementById('modalApenasAlterados').checked = false;
     document.getElementById('confirmModal').classList.add('show');
 }
 
@@ -146,33 +175,59 @@ export async function confirmPrint() {
     const path     = document.getElementById('folderPath').value.trim();
     const printer  = document.getElementById('printerSelect').value || null;
     const fase     = document.getElementById('modalFase').value || null;
+    const urgente  = document.getElementById('modalUrgente').checked;
+    const apenasAlterados = document.getElementById('modalApenasAlterados').checked;
     const btn      = document.getElementById('printBtn');
     btn.disabled   = true;
     btn.innerHTML  = '⏳ Imprimindo...';
     document.getElementById('progressContainer').classList.add('active');
 
     try {
-        const data = await apiPrint(path, printer, selected.map(f => f.path), state.authToken, fase);
-        let idx = 0;
+        const data = await apiPrint(path, printer, selected.map(f => f.path), state.authToken, fase, urgente, apenasAlterados);
+        // No modo só alterados parte dos arquivos volta em "unchanged", sem resultado de impressão.
+        // Pelo caminho: o mesmo nome pode estar em duas pastas ENG do produto
+        const resultados  = new Map(data.results.map(r => [r.path, r]));
+        const inalterados = new Set((data.unchanged || []).map(u => u.path));
         state.currentFiles.forEach((file, i) => {
-            if (file.selected && data.results[idx]) {
-                const el = document.getElementById(`status-${i}`);
-                el.className = `file-status ${data.results[idx].success ? 'success' : 'error'}`;
-                el.textContent = data.results[idx].success ? '✓' : '✗';
-                idx++;
-                const pct = Math.round((idx / data.total) * 100);
-                document.getElementById('progressFill').style.width = `${pct}%`;
-                document.getElementById('progressPercent').textContent = `${pct}%`;
+            if (!file.selected) return;
+            const el = document.getElementById(`status-${i}`);
+            const r  = resultados.get(file.path);
+            if (r && r.success && r.registrado === false) {
+                el.className   = 'file-status error';
+                el.textContent = '⚠';
+                el.title       = `Impresso (${r.codigo_rastreio}), mas não registrado no rastreio`;
+            } else if (r) {
+                el.className   = `file-status ${r.success ? 'success' : 'error'}`;
+                el.textContent = r.success ? '✓' : '✗';
+            } else if (inalterados.has(file.path)) {
+                el.className   = 'file-status skipped';
+                el.textContent = '=';
+                el.title       = 'Igual à última impressão';
             }
         });
+        document.getElementById('progressFill').style.width = '100%';
+        document.getElementById('progressPercent').textContent = '100%';
         document.getElementById('progressText').textContent = 'Concluído!';
-        showToast(
-            `${data.printed}/${data.total} impressos! Documentos registrados no rastreio.`,
-            data.printed === data.total ? 'success' : 'warning'
-        );
+        const pulados = inalterados.size ? ` ${inalterados.size} sem alteração (não reimpressos).` : '';
+        const semRegistro = (data.nao_registrados || []).length;
+        if (semRegistro) {
+            showToast(
+                `${data.printed}/${data.total} impressos, mas ${semRegistro} não foram registrados no rastreio ` +
+                `(${data.nao_registrados.map(n => n.codigo_rastreio).join(', ')}). Avise o administrador.`,
+                'error'
+            );
+        } else {
+            showToast(
+                data.total
+                    ? `${data.printed}/${data.total} impressos! Documentos registrados no rastreio.${pulados}`
+                    : `Nenhum PDF alterado desde a última impressão.${pulados}`,
+                data.printed === data.total ? 'success' : 'warning'
+            );
+        }
         setTimeout(loadDocs, 1000);
     } catch (error) {
         showToast('Erro: ' + error.message, 'error');
+        document.getElementById('progressContainer').classList.remove('active');
     } finally {
         btn.disabled = false;
         updateCounts();
@@ -1,5 +1,5 @@
 import { state } from './state.js';
-import { apiGetDocumentos, apiUpdateStatus, apiUpdateFase } from './api.js';
+import { apiGetDocumentos, apiUpdateStatus, apiUpdateFase, apiBuscarDocumentos } from './api.js';
 import { showToast, closeModal } from './ui.js';
 
 export async function loadDocs() {
@@ -7,7 +7,8 @@ export async function loadDocs() {
         const data = await apiGetDocumentos(500);
         state.allDocs = data.documentos;
         updateSummary();
-        renderDocs();
+        if (state.searchDocs) await searchDocs(1);
+        else renderDocs();
     } catch {
         showToast('Erro ao carregar documentos', 'error');
     }
@@ -26,7 +27,7 @@ export function setFilter(filter) {
     state.currentFaseFilter = null;
     document.querySelectorAll('.filter-tab').forEach(t => t.classList.remove('active'));
     document.getElementById(`f${filter}`).classList.add('active');
-    renderDocs();
+    refreshDocs();
 }
 
 export function setFaseFilter(fase) {
@@ -36,28 +37,59 @@ export function setFaseFilter(fase) {
     const ids = { 'Lote Teste': 'ff-teste', 'Lote Piloto': 'ff-piloto', 'Lote Padrão': 'ff-padrao' };
     const el = document.getElementById(ids[fase]);
     if (el) el.classList.add('active');
-    renderDocs();
+    refreshDocs();
 }
 
-export function filterDocs() { renderDocs(); }
+// Com busca ativa os filtros vão para o servidor; sem busca filtram a lista local
+function refreshDocs() {
+    if (state.searchDocs) searchDocs(1);
+    else renderDocs();
+}
 
-export function renderDocs() {
-    const search = document.getElementById('trackSearch').value.toLowerCase();
-    let docs = state.allDocs;
+// A busca roda no servidor (histórico completo); a lista local cobre só os 500 mais recentes
+export function filterDocs() {
+    clearTimeout(state.trackSearchTimeout);
+    state.trackSearchTimeout = setTimeout(() => searchDocs(1), 300);
+}
+
+function searchKey() {
+    return [document.getElementById('trackSearch').value.trim(), state.currentFilter, state.currentFaseFilter].join('|');
+}
 
-    if (state.currentFilter !== 'todos') {
-        docs = docs.filter(d => d.status === state.currentFilter);
+async function searchDocs(pagina) {
+    const search = document.getElementById('trackSearch').value.trim();
+    if (search.length < 2) {
+        state.searchDocs = null;
+        renderDocs();
+        return;
     }
-    if (state.currentFaseFilter) {
-        docs = docs.filter(d => d.fase === state.currentFaseFilter);
+    const key    = searchKey();
+    const status = state.currentFilter !== 'todos' ? state.currentFilter : null;
+    try {
+        const data = await apiBuscarDocumentos(search, pagina, 200, status, state.currentFaseFilter);
+        if (key !== searchKey()) return;  // chegou resposta de uma busca (ou filtro) antiga
+        state.searchDocs   = pagina === 1 ? data.documentos : state.searchDocs.concat(data.documentos);
+        state.searchTotal  = data.total_limitado ? `${data.total}+` : data.total;
+        state.searchPagina = pagina;
+        renderDocs();
+    } catch {
+        showToast('Erro ao buscar documentos', 'error');
     }
-    if (search) {
-        docs = docs.filter(d =>
-            d.codigo_rastreio.toLowerCase().includes(search) ||
-            d.produto.toLowerCase().includes(search) ||
-            d.arquivo.toLowerCase().includes(search) ||
-            (d.impresso_por_nome || '').toLowerCase().includes(search)
-        );
+}
+
+export function loadMoreDocs() { searchDocs(state.searchPagina + 1); }
+
+export function renderDocs() {
+    let docs = state.searchDocs ?? state.allDocs;
+
+    // O resultado da busca já vem filtrado pelo servidor
+    if (!state.searchDocs) {
+        if (state.currentFilter !== 'todos') {
+            docs = docs.filter(d => d.status === state.currentFilter);
+        }
+        if (state.currentFaseFilter) {
+            docs = docs.filter(d => d.fase === state.currentFaseFilter);
+        }
     }
 
     const tbody = document.getElementById('docsTableBody');
@@ -66,6 +98,12 @@ export function renderDocs() {
         return;
     }
 
+    const moreHtml = state.searchDocs && state.searchDocs.length < parseInt(state.searchTotal)
+        ? `<tr><td colspan="8" style="text-align:center; padding: 1rem;">
+               <button class="btn btn-secondary btn-xs" style="margin: 0 auto;" onclick="loadMoreDocs()">Carregar mais (${state.searchDocs.length} de ${state.searchTotal})</button>
+           </td></tr>`
+        : '';
+
     tbody.innerHTML = docs.map(doc => {
         const statusHtml = {
             entregue: `<span class="status-pill status-entregue">📄 Entregue</span>`,
@@ -95,7 +133,7 @@ export function renderDocs() {
             <td>${statusHtml}</td>
             <td><div class="actions">${actionsHtml}</div></td>
         </tr>`;
-    }).join('');
+    }).join('') + moreHtml;
 }
 
 function buildTooltip(doc) {
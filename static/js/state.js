@@ -3,10 +3,14 @@ export const state = {
     authToken: null,
     currentUser: null,
     allDocs: [],
+    searchDocs: null,          // resultado da busca no servidor (null = sem busca ativa)
+    searchTotal: 0,
+    searchPagina: 1,
     currentFiles: [],
     currentFilter: 'todos',
     currentFaseFilter: null,
     pendingStatusUpdate: null,
     pendingFaseUpdate: null,
     searchTimeout: null,
+    trackSearchTimeout: null,
 };
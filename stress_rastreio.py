@@ -0,0 +1,163 @@
+"""
+Teste de estresse do código de rastreio
+Simula impressões em lote concorrentes em vários processos (e opcionalmente vários nós,
+cada um com seu próprio banco) e verifica que nenhum codigo_rastreio se repete.
+
+Com --api, cada processo é um worker do app (banco e FASTPRINT_NODE_ID do seu nó) e
+os lotes vão todos ao mesmo tempo para /api/print, com uma impressora simulada.
+Os nós padrão (PRINTSRV00, PRINTSRV01...) só diferem no fim do nome, como hosts reais.
+
+Uso:
+    python stress_rastreio.py --processos 8 --lotes 25 --tamanho 20 --nos 2
+    python stress_rastreio.py --api --processos 4 --lotes 10 --tamanho 20 --nos 2
+"""
+
+import argparse
+import asyncio
+import multiprocessing as mp
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+
+def _worker(db_path: str, no: str, lotes: int, tamanho: int, fila):
+    # O banco é escolhido por variável de ambiente antes de importar database
+    os.environ["FASTPRINT_DB"] = db_path
+    import database
+
+    codigos = []
+    for lote in range(lotes):
+        # Alterna os dois caminhos: reserva em bloco (lote) e código avulso
+        if lote % 2 == 0:
+            bloco = database.reservar_codigos_rastreio(no, tamanho)
+        else:
+            bloco = [database.gerar_codigo_rastreio(no) for _ in range(tamanho)]
+        for i, codigo in enumerate(bloco):
+            database.registrar_documento_impresso(
+                codigo_rastreio=codigo,
+                produto=f"STRESS {lote}",
+                arquivo=f"arquivo_{i}.pdf",
+                pasta="stress",
+                impressora="stress",
+                computador=no,
+                usuario_id=1,
+            )
+        codigos.extend(bloco)
+    fila.put(codigos)
+
+
+def _worker_api(db_path: str, no: str, lotes: int, tamanho: int, pasta: str, fila):
+    os.environ["FASTPRINT_DB"] = db_path
+    os.environ["FASTPRINT_NODE_ID"] = no
+    # Todos os lotes do processo entram na fila de uma vez
+    os.environ["FASTPRINT_LOTES_USUARIO"] = str(lotes)
+    os.environ["FASTPRINT_FILA_IMPRESSORA"] = str(lotes * tamanho)
+    import httpx
+    import main
+
+    main.print_pdf = lambda pdf_path, printer=None: {"success": True, "message": "ok"}
+    main.stamp_pdf = lambda pdf_path, codigo, fase=None: None
+    arquivos = sorted(str(p) for p in Path(pasta).glob("*.pdf"))[:tamanho]
+
+    async def executar():
+        async with main.app.router.lifespan_context(main.app):
+            transporte = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transporte, base_url="http://stress", timeout=None) as client:
+                respostas = await asyncio.gather(*(
+                    client.post("/api/print", json={"folder_path": pasta, "printer": "stress", "selected_files": arquivos},
+                                headers={"Authorization": "Bearer temp"})
+                    for _ in range(lotes)
+                ))
+        codigos = []
+        for r in respostas:
+            r.raise_for_status()
+            dados = r.json()
+            if dados["printed"] != len(arquivos):
+                raise RuntimeError(f"Lote incompleto: {dados}")
+            codigos.extend(dados["codigos_rastreio"])
+        return codigos
+
+    fila.put(asyncio.run(executar()))
+
+
+def _preparar_banco(db_path: str):
+    os.environ["FASTPRINT_DB"] = db_path
+    import database
+    database.init_db()
+    conn = database.get_connection()
+    conn.execute("INSERT OR IGNORE INTO usuarios (id, nome, usuario, senha_hash) VALUES (1, 'Stress', 'stress', '-')")
+    conn.commit()
+    conn.close()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--processos", type=int, default=8, help="processos por nó")
+    parser.add_argument("--lotes", type=int, default=25, help="lotes por processo")
+    parser.add_argument("--tamanho", type=int, default=20, help="arquivos por lote")
+    parser.add_argument("--nos", type=int, default=2, help="hosts simulados, cada um com seu banco")
+    parser.add_argument("--api", action="store_true", help="imprime pelo /api/print em vez de chamar o banco")
+    args = parser.parse_args()
+
+    ctx = mp.get_context("spawn")
+    tmpdir = Path(tempfile.mkdtemp(prefix="fp_stress_"))
+    bancos = {f"PRINTSRV{n:02d}": str(tmpdir / f"no{n}.db") for n in range(args.nos)}
+    for db_path in bancos.values():
+        p = ctx.Process(target=_preparar_banco, args=(db_path,))
+        p.start()
+        p.join()
+
+    fila = ctx.Queue()
+    if args.api:
+        pasta = tmpdir / "share" / "510000000 - STRESS"
+        pasta.mkdir(parents=True)
+        for i in range(args.tamanho):
+            (pasta / f"arquivo_{i}.pdf").write_bytes(b"%PDF-1.4\n%%EOF\n")
+        alvo, extra = _worker_api, (str(pasta),)
+    else:
+        alvo, extra = _worker, ()
+    processos = [
+        ctx.Process(target=alvo, args=(db_path, no, args.lotes, args.tamanho, *extra, fila))
+        for no, db_path in bancos.items()
+        for _ in range(args.processos)
+    ]
+    inicio = time.perf_counter()
+    for p in processos:
+        p.start()
+    codigos = []
+    for _ in processos:
+        try:
+            codigos.extend(fila.get(timeout=600))
+        except Exception:
+            break  # um worker morreu sem responder: a contagem abaixo acusa
+    for p in processos:
+        p.join()
+    duracao = time.perf_counter() - inicio
+
+    falhas = [p for p in processos if p.exitcode != 0]
+    esperado = len(processos) * args.lotes * args.tamanho
+    unicos = len(set(codigos))
+
+    # União dos bancos: um código repetido entre nós também conta como falha
+    todos = set()
+    for db_path in bancos.values():
+        conn = sqlite3.connect(db_path)
+        todos.update(r[0] for r in conn.execute("SELECT codigo_rastreio FROM documentos_impressos"))
+        conn.close()
+    gravados = len(todos)
+
+    print(f"Processos: {len(processos)} ({args.nos} nós) | Códigos: {len(codigos)}/{esperado} | "
+          f"Únicos: {unicos} | Gravados: {gravados} | {duracao:.1f}s ({len(codigos) / duracao:.0f} códigos/s)")
+
+    if falhas or len(codigos) != esperado or unicos != esperado or gravados != esperado:
+        print("FALHOU: códigos duplicados ou perdidos")
+        return 1
+    print("OK: nenhum codigo_rastreio duplicado")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
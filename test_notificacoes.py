@@ -0,0 +1,128 @@
+"""
+Envio do outbox de notificações contra um SMTP falso, num banco temporário.
+
+Uso:
+    python -m pytest test_notificacoes.py
+"""
+
+import smtplib
+import time
+
+import pytest
+
+import database
+from notificacoes import OutboxSender
+
+
+class SMTPFalso:
+    """Guarda as mensagens em vez de enviar; `ao_enviar(msg)` roda antes de cada envio"""
+
+    def __init__(self, falhar: bool = False, ao_enviar=None):
+        self.falhar = falhar
+        self.ao_enviar = ao_enviar
+        self.enviadas = []
+
+    def send_message(self, msg):
+        if self.ao_enviar:
+            self.ao_enviar(msg)
+        if self.falhar:
+            raise smtplib.SMTPException("recusado")
+        self.enviadas.append(msg)
+
+    def quit(self):
+        pass
+
+
+@pytest.fixture(autouse=True)
+def banco(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "DB_PATH", tmp_path / "fastprint.db")
+    database.init_db()
+
+
+def enfileirar(produto: str, destinatario: str, codigo: str, fase: str = "Lote Piloto"):
+    dados = {
+        "codigo_rastreio": codigo, "arquivo": f"{codigo}.pdf", "fase": fase, "fase_anterior": "Lote Teste",
+        "por_produto": False, "documentos": 1, "usuario": "Teste", "em": database._agora(),
+    }
+    with database.transacao() as conn:
+        database._enfileirar_notificacao(conn, "fase", produto, [destinatario], dados)
+
+
+def situacao() -> dict[int, dict]:
+    conn = database.get_connection()
+    rows = conn.execute("SELECT id, status, tentativas, erro FROM notificacoes_outbox").fetchall()
+    conn.close()
+    return {r["id"]: dict(r) for r in rows}
+
+
+def remetente(smtp: SMTPFalso, **kwargs) -> OutboxSender:
+    sender = OutboxSender(host="smtp.falso", **kwargs)
+    sender._conectar = lambda: smtp
+    return sender
+
+
+def test_um_resumo_por_produto_e_destinatario():
+    enfileirar("MESA", "a@linea", "FP-1")
+    enfileirar("MESA", "a@linea", "FP-2")
+    enfileirar("CADEIRA", "a@linea", "FP-3")
+    smtp = SMTPFalso()
+
+    resultado = remetente(smtp).processar()
+
+    assert resultado == {"eventos": 3, "emails": 2, "falhas": 0, "ignorados": 0}
+    assuntos = sorted(m["Subject"] for m in smtp.enviadas)
+    assert "(2 alterações)" in assuntos[1] and "MESA" in assuntos[1]
+    assert all(s["status"] == "enviado" for s in situacao().values())
+
+
+def test_falha_no_envio_volta_para_a_fila():
+    enfileirar("MESA", "a@linea", "FP-1")
+
+    resultado = remetente(SMTPFalso(falhar=True)).processar()
+
+    assert resultado["falhas"] == 1
+    [linha] = situacao().values()
+    assert linha["status"] == "pendente" and linha["tentativas"] == 1 and linha["erro"] == "recusado"
+
+
+def test_lease_renovado_antes_de_cada_envio():
+    enfileirar("MESA", "a@linea", "FP-1")
+    enfileirar("CADEIRA", "a@linea", "FP-2")
+    envios = []
+
+    def lento(msg):
+        # O primeiro envio demora mais que o lease; durante o segundo, outro worker procura trabalho
+        envios.append(msg)
+        if len(envios) == 1:
+            time.sleep(1.1)
+        else:
+            assert database.reservar_notificacoes() == []  # o lease do grupo foi renovado
+
+    smtp = SMTPFalso(ao_enviar=lento)
+    resultado = remetente(smtp, lease_s=1).processar()
+
+    assert resultado["emails"] == 2 and resultado["ignorados"] == 0
+
+
+def test_lease_vencido_e_pego_por_outro_worker_nao_reenvia():
+    enfileirar("MESA", "a@linea", "FP-1")
+    enfileirar("CADEIRA", "a@linea", "FP-2")
+    pegos = []
+
+    def lease_vence(msg):
+        # Durante o envio de MESA o lease de CADEIRA vence e outro worker o reserva
+        if pegos:
+            return
+        conn = database.get_connection()
+        conn.execute("UPDATE notificacoes_outbox SET proxima_tentativa = ? WHERE produto = 'CADEIRA'",
+                     (database._agora(-1),))
+        conn.commit()
+        conn.close()
+        pegos.extend(database.reservar_notificacoes(lease_s=600))
+
+    smtp = SMTPFalso(ao_enviar=lease_vence)
+    resultado = remetente(smtp).processar()
+
+    assert [e["produto"] for e in pegos] == ["CADEIRA"]
+    assert resultado["emails"] == 1 and resultado["ignorados"] == 1
+    assert "MESA" in smtp.enviadas[0]["Subject"]
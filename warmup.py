@@ -0,0 +1,79 @@
+"""
+Aquecimento em segundo plano
+Depois que o servidor sobe, executa em sequência as etapas caras da primeira
+requisição (imports, fontes, impressoras, catálogo) sem bloquear quem já está usando.
+"""
+
+import importlib.util
+import time
+from datetime import datetime
+
+
+class WarmUp:
+    """Estado das etapas de aquecimento, exposto pelo endpoint de prontidão"""
+
+    def __init__(self):
+        self.etapas: dict[str, dict] = {}
+        self.iniciado_em = None
+        self.concluido_em = None
+
+    @property
+    def pronto(self) -> bool:
+        return self.concluido_em is not None
+
+    async def executar(self, etapas: list[tuple[str, object]], executor):
+        """
+        Roda cada (nome, fn) via `executor` (ex.: run_share). Uma etapa que falha
+        é registrada e não impede as seguintes: o sistema funciona sem aquecimento,
+        só fica mais lento na primeira vez.
+        """
+        self.iniciado_em = datetime.now().isoformat(timespec="seconds")
+        for nome, _ in etapas:
+            self.etapas[nome] = {"status": "pendente"}
+
+        for nome, fn in etapas:
+            etapa = self.etapas[nome]
+            etapa["status"] = "executando"
+            inicio = time.perf_counter()
+            try:
+                resultado = await executor(fn)
+                etapa["status"] = "ok"
+                if resultado is not None:
+                    etapa["resultado"] = resultado
+            except Exception as e:
+                etapa["status"] = "erro"
+                etapa["erro"] = str(e)
+            etapa["duracao_ms"] = round((time.perf_counter() - inicio) * 1000, 1)
+
+        self.concluido_em = datetime.now().isoformat(timespec="seconds")
+
+    def status(self) -> dict:
+        return {
+            "pronto": self.pronto,
+            "iniciado_em": self.iniciado_em,
+            "concluido_em": self.concluido_em,
+            "etapas": self.etapas,
+        }
+
+
+def pdf_disponivel() -> bool:
+    """pypdf e reportlab instalados (sem eles a impressão sai sem carimbo)"""
+    return all(importlib.util.find_spec(m) is not None for m in ("pypdf", "reportlab"))
+
+
+def aquecer_pdf():
+    """Importa pypdf/reportlab e carrega a fonte do carimbo (Helvetica)"""
+    import io
+    from pypdf import PdfReader, PdfWriter  # noqa: F401
+    from reportlab.pdfgen import canvas
+
+    packet = io.BytesIO()
+    c = canvas.Canvas(packet, pagesize=(595, 842))
+    c.setFont("Helvetica", 7)
+    c.drawString(20, 20, "FastPrint")
+    c.save()
+    packet.seek(0)
+    PdfReader(packet).pages[0]
+
+
+warmup = WarmUp()